@@ -1,61 +1,136 @@
 #!/usr/bin/env python3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import partial
 
-import requests
-import urllib3.exceptions
-
-from typing import Tuple, Optional, Union
+from typing import Iterable, Iterator, Tuple, Optional, Union, TYPE_CHECKING
+from json_stream import iter_array
 from logger import log
+from metrics import metrics
+from retry import RetryPolicy, AdaptiveConcurrency, RETRY_STATUS, OVERLOAD_STATUS, GATEWAY_STATUS
+
+if TYPE_CHECKING:
+    import requests
+    from metadata_cache import MetadataCache
+    from cassette import Cassette
+    from rate_limit import SharedRateLimiter
+
+
+# Epoch and resolution for sortable integer timestamps
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_iso_datetime_utc(date_str: str) -> datetime:
+    """
+    Helper function to parse an ISO 8601 datetime string in UTC format.
+    :param date_str: The ISO 8601 datetime string
+    :return: The parsed datetime object
+    """
+    return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
 
 
 # Template Object
-@dataclass
+@dataclass(slots=True)
 class CLTemplate:
     """
-    Dataclass to hold metadata for a Content Library item.
+    Compact, slotted record of a Content Library item. Only holds the fields needed for the retention logic.
+    The creation time is kept as sortable integer, the last modification time is only parsed when accessed.
     """
     id: str = None  # '91408a54-3932-4797-959f-5235b4d7cc90'
-    creation_time: datetime = None  # datetime('2024-05-26T00:43:52.651Z')
-    last_modified_time: datetime = None  # datetime('2024-05-26T00:44:14.630Z')
-    description: str = None  # 'Ubuntu 24.04 Template [...]'
+    name: str = None  # 'Ubuntu_24.04-Template (202405260033)'
     type: str = None  # 'vm-template'
-    version: str = None  # '1'
-    content_version: str = None  # '2'
     library_id: str = None  # '02c04568-0e25-45a1-b23a-39d912b86e58'
+    content_version: str = None  # '2'
     size: int = None  # 6027768102
-    cached: bool = None  # True
-    name: str = None  # 'Ubuntu_24.04-Template (202405260033)'
-    security_compliance: bool = None  # True
-    metadata_version: str = None  # '1'
+    creation_ts: int = None  # 1716684232651000 (microseconds since epoch, '2024-05-26T00:43:52.651Z')
+    last_modified: str = None  # '2024-05-26T00:44:14.630Z'
+
+    @classmethod
+    def from_metadata(cls, metadata: dict) -> 'CLTemplate':
+        """
+        Create a template from the metadata returned by the vCenter API. Unknown fields are ignored.
+        :param metadata: The metadata of the Content Library item
+        :return: The CLTemplate object
+        """
+        get = metadata.get
+        # Positional arguments in field order, this runs once per item
+        return cls(get('id'), get('name'), get('type'), get('library_id'), get('content_version'), get('size'),
+                   (parse_iso_datetime_utc(metadata['creation_time']) - EPOCH) // MICROSECOND,
+                   get('last_modified_time'))
+
+    @property
+    def creation_time(self) -> datetime:
+        """
+        The creation time as datetime object.
+        """
+        return EPOCH + self.creation_ts * MICROSECOND
+
+    @property
+    def last_modified_time(self) -> Optional[datetime]:
+        """
+        The last modification time as datetime object.
+        """
+        return parse_iso_datetime_utc(self.last_modified) if self.last_modified else None
 
 
 # vCenter API Class
 class VCAPI:
     """Class to interact with the vCenter API."""
 
-    def __init__(self, hostname: str, username: str, password: str):
+    def __init__(self, hostname: str, username: str, password: str, pool_size: int = 10,
+                 retry_policy: RetryPolicy = None, rate_limiter: 'Optional[SharedRateLimiter]' = None,
+                 cassette: 'Optional[Cassette]' = None, timeout: Tuple[float, float] = (10.0, 60.0),
+                 streams: int = 1):
         """
         Class initialization. Sets up object for the vCenter API connection.
-        :param hostname: The hostname of the vCenter server
+        :param hostname: The hostname of the vCenter server, optionally as URL with scheme (e.g. http://127.0.0.1:8080)
         :param username: The username to authenticate
         :param password: The password to authenticate
+        :param pool_size: The maximum number of keep-alive connections kept open to the vCenter server
+        :param retry_policy: The retry settings for failed or throttled requests
+        :param rate_limiter: The optional rate limiter shared with other processes on this host
+        :param cassette: The optional cassette to record the requests to, or to replay them from
+        :param timeout: The connect and read timeouts of a request in seconds; a timed out request is retried
+        :param streams: The number of listings streamed at the same time; each one holds a pooled connection while it
+                        is read, on top of the requests in flight
         """
         self.hostname = hostname
+        self.base_url = hostname if '://' in hostname else 'https://{}'.format(hostname)
         self.username = username
         self.password = password
         self.session_id = None
         self.insecure_ssl = False
-
-    # Helper functions
-    @staticmethod
-    def _parse_iso_datetime_utc(date_str: str) -> datetime:
-        """
-        Helper function to parse an ISO 8601 datetime string in UTC format.
-        :param date_str: The ISO 8601 datetime string
-        :return: The parsed datetime object
-        """
-        return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+        # IDs of the Content Libraries looked up by name
+        self.library_ids: dict[str, str] = {}
+
+        # requests and urllib3 take longer to import than everything else together, so they are only imported once
+        # the first vCenter connection is set up, not on runs which exit early
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Pooled keep-alive HTTP session, so each API call does not pay for a new TCP connect and TLS handshake
+        self.pool_size = max(1, pool_size)
+        pool_maxsize = self.pool_size + max(0, streams)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize) if cassette is None \
+            else cassette.adapter(pool_maxsize=pool_maxsize)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.verify = True
+        self.network_errors = (requests.ConnectionError, requests.Timeout)
+        # Without a timeout, a stalled connection would block the run forever
+        self.timeout = timeout
+
+        # Retries with backoff, and an adaptive limit of requests in flight backing off when vCenter is overloaded
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.concurrency = AdaptiveConcurrency(max_limit=self.pool_size)
+        self.retries = 0
+        self.stats_lock = threading.Lock()
+        self.rate_limiter = rate_limiter
 
     # General functions
     def allow_insecure_ssl(self, insecure: bool) -> None:
@@ -65,25 +140,137 @@ class VCAPI:
         :return: None
         """
         self.insecure_ssl = insecure
+        self.session.verify = not insecure
         if insecure:
             log(sev='warn', msg='Insecure SSL connections are allowed. Self-signed certificates will be accepted.')
+            import urllib3
             urllib3.disable_warnings(category=urllib3.exceptions.InsecureRequestWarning)
 
+    def connection_stats(self) -> dict[str, int]:
+        """
+        Statistics about the connections of the pooled HTTP session.
+        :return: The number of requests sent, connections opened and connections reused as dict
+        """
+        requests_sent = 0
+        connections_opened = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+        return {
+            'requests': requests_sent,
+            'opened': connections_opened,
+            'reused': max(0, requests_sent - connections_opened),
+        }
+
+    def close(self) -> None:
+        """
+        Close the pooled HTTP session and all its connections.
+        :return: None
+        """
+        stats = self.connection_stats()
+        log(sev='info', msg='Connection pool: {} requests sent, {} connections opened, {} connections reused.',
+            args=(stats['requests'], stats['opened'], stats['reused']))
+        log(sev='info', msg='Requests: {} retried, effective concurrency {} (lowest {}, max {}).',
+            args=(self.retries, self.concurrency.effective, self.concurrency.lowest, self.concurrency.max_limit))
+        self.session.close()
+
+    def _request(self, method: str, url: str, **kwargs) -> 'requests.Response':
+        """
+        Send a request through the pooled session. Retries throttled, unavailable and failed requests with backoff
+        and adapts the number of requests in flight to the health of the vCenter. A retried DELETE answered with 404
+        after a gateway or network error succeeded: the failed attempt reached the vCenter and deleted the resource.
+        :param method: The HTTP method
+        :param url: The URL to contact
+        :param kwargs: Further arguments for the request
+        :return: The response of the last attempt
+        """
+        endpoint = metrics.endpoint(method=method, path=url[len(self.base_url) + len('/api/'):])
+        attempt = 0
+        # Whether an earlier attempt may have been executed, even though no response was received
+        executed = False
+        while True:
+            resp, error = None, None
+            if self.rate_limiter is not None:
+                metrics.observe_wait(seconds=self.rate_limiter.acquire(key=self.base_url))
+            self.concurrency.acquire()
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(method=method, url=url, timeout=self.timeout, **kwargs)
+            except self.network_errors as e:
+                error = e
+            finally:
+                self.concurrency.release()
+            # The body of a streamed response is counted while it is read, see _iter_json()
+            metrics.observe(endpoint=endpoint, status=resp.status_code if resp is not None else 'error',
+                            seconds=time.perf_counter() - started,
+                            size=len(resp.content) if resp is not None and not kwargs.get('stream') else 0)
+
+            if resp is not None and resp.status_code not in RETRY_STATUS:
+                self.concurrency.on_success()
+                if executed and method == 'DELETE' and resp.status_code == 404:
+                    log(sev='info', msg='- {} {} was executed by an earlier attempt already.', args=(method, url))
+                    resp.status_code, resp._content = 204, b''
+                return resp
+            executed = executed or resp is None or resp.status_code in GATEWAY_STATUS
+            if resp is None or resp.status_code in OVERLOAD_STATUS:
+                self.concurrency.on_overload()
+
+            if attempt >= self.retry_policy.retries:
+                if resp is None:
+                    raise error
+                return resp
+
+            delay = self.retry_policy.delay(attempt=attempt,
+                                            retry_after=resp.headers.get('Retry-After') if resp is not None else None)
+            log(sev='warn', msg='- {} {} failed with {}, retrying in {:.2f}s (attempt {}/{})...',
+                args=(method, url, resp.status_code if resp is not None else error, delay, attempt + 1,
+                      self.retry_policy.retries))
+            with self.stats_lock:
+                self.retries += 1
+            if resp is not None:
+                # Hand the connection back to the pool, a streamed response holds it until closed
+                resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _iter_json(resp: 'requests.Response', chunk_size: int = 65536) -> Iterator:
+        """
+        Helper function to decode the JSON array of a streamed response value by value, while it is received.
+        :param resp: The streamed response
+        :param chunk_size: The number of bytes read at once
+        :return: Iterator over the values of the array
+        """
+        def chunks() -> Iterator[bytes]:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                metrics.received(size=len(chunk))
+                yield chunk
+
+        try:
+            yield from iter_array(chunks())
+        finally:
+            resp.close()
+
     # Generic API functions
-    def get(self, path: str, payload: dict = None) -> Tuple[bool, int, Union[dict, str]]:
+    def get(self, path: str, payload: dict = None, fail_hard: bool = True) -> Tuple[bool, int, Union[dict, str]]:
         """
         Generic GET function to contact the vCenter API.
         :param path: The API endpoint to contact
         :param payload: The payload to send
+        :param fail_hard: The flag to treat an error response as fatal error; otherwise it is only logged as debug
         :return: The JSON response from the API
         """
-        url = 'https://{}/api/{}'.format(self.hostname, path)
-        log(sev='debug', msg='- Contacting API via GET {1} with payload {0}...'.format(payload, url))
-        resp = requests.get(url=url, verify=(not self.insecure_ssl), params=payload,
-                            headers={'vmware-api-session-id': self.session_id})
+        url = '{}/api/{}'.format(self.base_url, path)
+        log(sev='debug', msg='- Contacting API via GET {1} with payload {0}...', args=(payload, url))
+        resp = self._request(method='GET', url=url, params=payload, headers={'vmware-api-session-id': self.session_id})
 
         if not resp.ok:
-            log(sev='error', msg='Error! API responded with: {}, content: {}'.format(resp.status_code, resp.text))
+            log(sev='error' if fail_hard else 'debug', msg='Error! API responded with: {}, content: {}',
+                args=(resp.status_code, resp.text))
             return False, resp.status_code, resp.text
 
         # Check if we have a JSON response from GET request
@@ -92,23 +279,25 @@ class VCAPI:
             json = resp.json()
         return True, resp.status_code, json
 
-    def post(self, path: str, payload: dict = None) -> Tuple[bool, int, Union[dict, str]]:
+    def post(self, path: str, payload: dict = None, fail_hard: bool = True) -> Tuple[bool, int, Union[dict, str]]:
         """
         Generic POST function to contact the vCenter API.
         :param path: The API endpoint to contact
         :param payload: The payload to send
+        :param fail_hard: The flag to treat an error response as fatal error; otherwise it is only logged as debug
         :return: The JSON response from the API
         """
         headers = {
             'content-type': 'application/json',
             'vmware-api-session-id': self.session_id
         }
-        url = 'https://{}/api/{}'.format(self.hostname, path)
-        log(sev='debug', msg='- Contacting API {1} via POST with payload {0}...'.format(payload, url))
-        resp = requests.post(url=url, verify=(not self.insecure_ssl), json=payload, headers=headers)
+        url = '{}/api/{}'.format(self.base_url, path)
+        log(sev='debug', msg='- Contacting API {1} via POST with payload {0}...', args=(payload, url))
+        resp = self._request(method='POST', url=url, json=payload, headers=headers)
 
         if not resp.ok:
-            log(sev='error', msg='Error! API responded with: {}, content: {}'.format(resp.status_code, resp.text))
+            log(sev='error' if fail_hard else 'debug', msg='Error! API responded with: {}, content: {}',
+                args=(resp.status_code, resp.text))
             return False, resp.status_code, resp.text
 
         # Check if we have a JSON response from POST request
@@ -128,11 +317,11 @@ class VCAPI:
             'content-type': 'application/json',
             'vmware-api-session-id': self.session_id
         }
-        url = 'https://{}/api/{}'.format(self.hostname, path)
-        log(sev='debug', msg='- Contacting API {1} via DELETE with payload {0}...'.format(payload, url))
-        resp = requests.delete(url=url, verify=(not self.insecure_ssl), json=payload, headers=headers)
+        url = '{}/api/{}'.format(self.base_url, path)
+        log(sev='debug', msg='- Contacting API {1} via DELETE with payload {0}...', args=(payload, url))
+        resp = self._request(method='DELETE', url=url, json=payload, headers=headers)
         if not resp.ok:
-            log(sev='error', msg='Error! API responded with: {}, content: {}'.format(resp.status_code, resp.text))
+            log(sev='error', msg='Error! API responded with: {}, content: {}', args=(resp.status_code, resp.text))
             return False, resp.status_code, resp.text
 
         # Check if we have a JSON response from POST request
@@ -147,18 +336,36 @@ class VCAPI:
         Authenticate to the vCenter API.
         :return: True if the login was successful, False otherwise
         """
-        log(sev='info', msg='Authenticating to vCenter as {}...'.format(self.username))
-        api_url = 'https://{}/api/session'.format(self.hostname)
-        resp = requests.post(url=api_url, auth=(self.username, self.password), verify=(not self.insecure_ssl))
+        log(sev='info', msg='Authenticating to vCenter as {}...', args=(self.username,))
+        api_url = '{}/api/session'.format(self.base_url)
+        resp = self._request(method='POST', url=api_url, auth=(self.username, self.password))
         if resp.status_code != 201:
-            log(sev='error', msg='Error occurred. API response: [{}] {}'
-                .format(resp.status_code, resp.text))
+            log(sev='error', msg='Error occurred. API response: [{}] {}',
+                args=(resp.status_code, resp.text))
             return False
 
         log(sev='debug', msg=' Authenticated to vCenter.')
         self.session_id = resp.json()
         return True
 
+    def resume(self, session_id: str) -> bool:
+        """
+        Reuse an existing session of the vCenter API instead of a new login, if vCenter still accepts it.
+        :param session_id: The session token of the existing session
+        :return: True if the session is still valid, False otherwise
+        """
+        log(sev='info', msg='Reusing cached vCenter session of {}...', args=(self.username,))
+        api_url = '{}/api/session'.format(self.base_url)
+        resp = self._request(method='GET', url=api_url, headers={'vmware-api-session-id': session_id})
+        if resp.status_code != 200:
+            log(sev='info', msg='Cached vCenter session is no longer valid. API response: [{}]',
+                args=(resp.status_code,))
+            return False
+
+        log(sev='debug', msg=' Cached vCenter session is valid.')
+        self.session_id = session_id
+        return True
+
     def logout(self) -> bool:
         """
         Logout from the vCenter API.
@@ -166,13 +373,12 @@ class VCAPI:
         """
         log(sev='info', msg='Logging out from vCenter...')
 
-        api_url = 'https://{}/api/session'.format(self.hostname)
-        log(sev='debug', msg='- Contacting API: {}'.format(api_url))
-        resp = requests.delete(url=api_url, verify=(not self.insecure_ssl),
-                               headers={'vmware-api-session-id': self.session_id})
+        api_url = '{}/api/session'.format(self.base_url)
+        log(sev='debug', msg='- Contacting API: {}', args=(api_url,))
+        resp = self._request(method='DELETE', url=api_url, headers={'vmware-api-session-id': self.session_id})
         if resp.status_code != 204:
-            log(sev='error', msg='Error occurred. API response: [{}] {}'
-                .format(resp.status_code, resp.text))
+            log(sev='error', msg='Error occurred. API response: [{}] {}',
+                args=(resp.status_code, resp.text))
             return False
 
         log(sev='debug', msg='Logged out from vCenter.')
@@ -189,21 +395,51 @@ class VCAPI:
         if not success:
             return None
         if len(library_id) != 1:
-            log(sev='error', msg='Error! Found {} Content Libraries with the name {}. Must be unambiguously. Exiting...'
-                .format(len(library_id), name))
+            log(sev='error', msg='Error! Found {} Content Libraries with the name {}. '
+                                 'Must be unambiguously. Exiting...', args=(len(library_id), name))
             return None
         # We have only one match, so easy to pick the right one
+        self.library_ids[name] = library_id[0]
         return library_id[0]
 
-    def get_library_items(self, library_id: str) -> Optional[dict]:
+    def get_library_items(self, library_id: str) -> Optional[list]:
         """
         Get all items in a Content Library.
         :param library_id: The ID of the Content Library
         :return: The list of items in the Content Library
         """
-        log(sev='debug', msg='Retrieving items in Content Library with ID {}...'.format(library_id))
-        success, _, output = self.get(path='content/library/item', payload={'library_id': library_id})
-        if not success:
+        items = self.iter_library_items(library_id=library_id)
+        if items is None:
+            return None
+        return list(items)
+
+    def iter_library_items(self, library_id: str) -> Optional[Iterator[str]]:
+        """
+        Stream the items in a Content Library. The vCenter API has no pagination for the listing, so the response is
+        decoded while it is received instead, and the IDs are handed out one by one.
+        :param library_id: The ID of the Content Library
+        :return: Iterator over the IDs of the items in the Content Library; the request is sent right away
+        """
+        log(sev='debug', msg='Retrieving items in Content Library with ID {}...', args=(library_id,))
+        url = '{}/api/content/library/item'.format(self.base_url)
+        resp = self._request(method='GET', url=url, params={'library_id': library_id},
+                             headers={'vmware-api-session-id': self.session_id}, stream=True)
+        if not resp.ok:
+            log(sev='error', msg='Error! API responded with: {}, content: {}', args=(resp.status_code, resp.text))
+            return None
+        return self._iter_json(resp=resp)
+
+    def find_library_items(self, library_id: str, item_type: str) -> Optional[list]:
+        """
+        Find the items of a given type in a Content Library, filtered on the vCenter side.
+        :param library_id: The ID of the Content Library
+        :param item_type: The type of the items, e.g. 'vm-template'
+        :return: The list of matching item IDs, or None if the vCenter does not support the filter
+        """
+        log(sev='debug', msg='Finding items of type {} in Content Library with ID {}...', args=(item_type, library_id))
+        success, _, output = self.post(path='content/library/item?action=find',
+                                       payload={'library_id': library_id, 'type': item_type}, fail_hard=False)
+        if not success or not isinstance(output, list):
             return None
         return output
 
@@ -211,10 +447,14 @@ class VCAPI:
         """
         Get metadata for a Content Library item. Like creation time, etc.
         :param item_id: The ID of the Content
-        :return: The metadata for the Content Library item as dict
+        :return: The metadata for the Content Library item as dict, or None if it could not be retrieved
         """
-        log(sev='debug', msg='Retrieving metadata for Content Library item {}...'.format(item_id))
-        success, _, output = self.get(path='content/library/item/{}'.format(item_id))
+        log(sev='debug', msg='Retrieving metadata for Content Library item {}...', args=(item_id,))
+        try:
+            success, _, output = self.get(path='content/library/item/{}'.format(item_id), fail_hard=False)
+        except self.network_errors as e:
+            log(sev='debug', msg='- Request failed: {}', args=(e,))
+            return None
         if not success:
             return None
         return output
@@ -225,85 +465,219 @@ class VCAPI:
         :param item_id: The ID of the Content Library item
         :return: True if the deletion was successful, int otherwise
         """
-        log(sev='debug', msg='Deleting Content Library item {}...'.format(item_id))
+        log(sev='debug', msg='Deleting Content Library item {}...', args=(item_id,))
         success, status_code, output = self.delete(path='content/library/item/{}'.format(item_id), payload={})
         if status_code != 204:
             return False, output
         return True, None
 
-    def get_cls_templates(self, library: str) -> Optional[dict]:
+    def get_cls_templates(self, library: str, concurrency: int = 8, server_filter: bool = True,
+                          cache: 'Optional[MetadataCache]' = None) -> Optional[dict]:
         """
-        The main cleanup function. This function will go through the Content Library and delete all outdated items.
+        Retrieve all vm-templates of a Content Library at once, see iter_cls_templates().
         :param library: The name of the Content Library
+        :param concurrency: The maximum number of metadata requests in flight at the same time
+        :param server_filter: The flag to let the vCenter filter the vm-template items before fetching metadata
+        :param cache: The optional metadata cache to serve known items from and to store fetched items in
         :return: The list of Content Library items as dict
         """
+        return {template.id: template for template in self.iter_cls_templates(
+            library=library, concurrency=concurrency, server_filter=server_filter, cache=cache)}
+
+    def iter_cls_templates(self, library: str, concurrency: int = 8, server_filter: bool = True,
+                           cache: 'Optional[MetadataCache]' = None) -> Iterator[CLTemplate]:
+        """
+        The main retrieval pipeline: streams the listing of the Content Library, serves known items from the cache
+        and retrieves the metadata of the other items with a bounded number of requests in flight. The templates are
+        handed out as soon as they are known, so only the work in flight is held in memory, not the whole library.
+        Consuming the templates is part of the 'metadata_fetch' phase.
+        :param library: The name of the Content Library
+        :param concurrency: The maximum number of metadata requests in flight at the same time
+        :param server_filter: The flag to let the vCenter filter the vm-template items before fetching metadata
+        :param cache: The optional metadata cache to serve known items from and to store fetched items in
+        :return: Iterator over the vm-templates of the Content Library
+        """
         # Get Content Library ID and check if we only have one identical match
-        clid = self.get_library_id(name=library)
+        with metrics.phase('library_lookup'):
+            clid = self.get_library_id(name=library)
         if clid is None:
             log(sev='error', msg='Error! Error occurred while retrieving Content Library ID.')
             return
 
-        log(sev='info', msg='Content Library ID for "{}" is: {}'.format(library, clid))
+        log(sev='info', msg='Content Library ID for "{}" is: {}', args=(library, clid))
 
-        # Get all items in the Content Library
-        log(sev='info', msg='Retrieving items in Content Library with ID {}...'.format(clid))
-        cl_items = self.get_library_items(library_id=clid)
+        # Start streaming the items in the Content Library
+        log(sev='info', msg='Retrieving items in Content Library with ID {}...', args=(clid,))
+        with metrics.phase('listing'):
+            cl_items = self.iter_library_items(library_id=clid)
 
         # Check if we have any items in the Content Library
         if cl_items is None:
             log(sev='error', msg='Error! Error occurred while retrieving Content Library items.')
             return
 
-        items_found = len(cl_items)
-        log(sev='debug', msg='Found {} items in Content Library.'.format(items_found))
-        if items_found == 0:
-            return {}
+        counts = {'items': 0, 'cached': 0, 'filtered': 0}
+        listed = set()
+        # Item IDs of the vm-template items, found on the vCenter side once the first item needs to be fetched
+        templates_found: Optional[set] = None
+
+        def candidates() -> Iterator[Union[str, CLTemplate]]:
+            """
+            Cached templates, and the IDs of the items whose metadata needs to be fetched, in listing order.
+            """
+            nonlocal server_filter, templates_found
+            for item_id in cl_items:
+                counts['items'] += 1
+                if cache is not None:
+                    listed.add(item_id)
+                    # Serve already known items from the metadata cache; only items never seen before are fetched
+                    template = cache.get(library_id=clid, item_id=item_id)
+                    if template is not None:
+                        counts['cached'] += 1
+                        yield template
+                        continue
+                    if cache.is_skipped(library_id=clid, item_id=item_id):
+                        continue
+
+                # Narrow down the candidates to vm-template items on the vCenter side, saving a metadata request per
+                # other item. Only items of the listing are considered, in case the library changes in between.
+                if server_filter and templates_found is None:
+                    found = self.find_library_items(library_id=clid, item_type='vm-template')
+                    if found is None:
+                        log(sev='info', msg='Server-side filtering of items is not supported, '
+                                            'retrieving metadata of all items.')
+                        server_filter = False
+                    else:
+                        templates_found = set(found)
+                if templates_found is not None and item_id not in templates_found:
+                    counts['filtered'] += 1
+                    if cache is not None:
+                        cache.skip(library_id=clid, item_id=item_id)
+                    continue
+                yield item_id
 
         # Go through the items and get metadata for each
-        cls_templates = {}
-        for item_id in cl_items:
-            log(sev='debug', msg=' Library-Item: {}'.format(item_id))
-
-            metadata = self.get_library_item_metadata(item_id=item_id)
-            if metadata is None:
-                log(sev='warning', msg='Error! Could not retrieve metadata for item {}. Skipping...'.format(item_id))
-                continue
+        with metrics.phase('metadata_fetch'):
+            yield from self.stream_cls_templates(items=candidates(), concurrency=concurrency, cache=cache,
+                                                 library_id=clid)
+
+        log(sev='debug', msg='Found {} items in Content Library.', args=(counts['items'],))
+        if cache is not None:
+            dropped = cache.prune(library_id=clid, item_ids=listed)
+            log(sev='info', msg='Metadata cache: {} items served from the cache, {} stale entries dropped.',
+                args=(counts['cached'], dropped))
+        if templates_found is not None:
+            log(sev='info', msg='Server-side filtering found {} vm-template items, saved {} metadata requests.',
+                args=(len(templates_found), counts['filtered']))
+
+    def fetch_cls_template(self, item_id: str, cache: 'Optional[MetadataCache]' = None,
+                           library_id: str = None) -> Optional[CLTemplate]:
+        """
+        Retrieve the metadata of a single Content Library item and turn it into a CLTemplate object.
+        :param item_id: The ID of the Content Library item
+        :param cache: The optional metadata cache to store the result in
+        :param library_id: The ID of the Content Library, required when a cache is given
+        :return: The CLTemplate object, or None if the item is not usable as template
+        """
+        log(sev='debug', msg=' Library-Item: {}', args=(item_id,))
 
-            # We can only process type=vm-template items
-            cl_type = metadata.get('type', '')
-            if cl_type != 'vm-template':
-                log(sev='info', msg='  Skipping item {}, type ({}) is not vm-template.'.format(item_id, cl_type))
-                continue
+        metadata = self.get_library_item_metadata(item_id=item_id)
+        if metadata is None:
+            log(sev='warning', msg='Error! Could not retrieve metadata for item {}. Skipping...', args=(item_id,))
+            return None
 
-            metadata['creation_time'] = self._parse_iso_datetime_utc(metadata['creation_time'])
-            metadata['last_modified_time'] = self._parse_iso_datetime_utc(metadata['last_modified_time'])
+        # We can only process type=vm-template items
+        cl_type = metadata.get('type', '')
+        if cl_type != 'vm-template':
+            log(sev='info', msg='  Skipping item {}, type ({}) is not vm-template.', args=(item_id, cl_type))
+            if cache is not None:
+                cache.skip(library_id=library_id, item_id=item_id)
+            return None
 
-            # Create a CLTemplate object from the metadata
-            try:
-                metadata = CLTemplate(**metadata)
-            except TypeError as e:
-                log(sev='warning', msg='Error! Could not initialize item {}: {}. Skipping...'.format(item_id, e))
-                continue
+        # Create a CLTemplate object from the metadata
+        try:
+            template = CLTemplate.from_metadata(metadata=metadata)
+        except (KeyError, TypeError, ValueError) as e:
+            log(sev='warning', msg='Error! Could not initialize item {}: {}. Skipping...', args=(item_id, e))
+            return None
 
-            # Store the template in the dict
-            cls_templates[item_id] = metadata
-            log(sev='debug', msg='  Name: {} / CreationTime: {}'
-                .format(metadata.name, metadata.creation_time))
+        log(sev='debug', msg='  Name: {0.name} / CreationTime: {0.creation_time}', args=(template,))
+        if cache is not None:
+            cache.put(library_id=library_id, template=template)
+        return template
 
-        return cls_templates
+    def fetch_cls_templates(self, item_ids: list[str], concurrency: int = 8, cache: 'Optional[MetadataCache]' = None,
+                            library_id: str = None) -> dict[str, CLTemplate]:
+        """
+        Retrieve the metadata of many Content Library items concurrently.
+        :param item_ids: The IDs of the Content Library items
+        :param concurrency: The maximum number of metadata requests in flight at the same time
+        :param cache: The optional metadata cache to store the results in
+        :param library_id: The ID of the Content Library, required when a cache is given
+        :return: The usable items as dict of CLTemplate objects, keyed by item ID
+        """
+        log(sev='debug', msg='Retrieving metadata for {} items with up to {} concurrent requests...',
+            args=(len(item_ids), concurrency))
+        return {template.id: template for template in self.stream_cls_templates(
+            items=item_ids, concurrency=concurrency, cache=cache, library_id=library_id)}
+
+    def stream_cls_templates(self, items: Iterable[Union[str, CLTemplate]], concurrency: int = 8,
+                             cache: 'Optional[MetadataCache]' = None,
+                             library_id: str = None) -> Iterator[CLTemplate]:
+        """
+        Retrieve the metadata of a stream of Content Library items concurrently. At most twice the concurrency is
+        requested ahead of the consumer, so the items are neither all submitted at once nor all held in memory.
+        The templates are handed out as their requests complete, so a slow or retried request does not hold up the
+        others.
+        :param items: The IDs of the Content Library items; templates known already are passed through right away
+        :param concurrency: The maximum number of metadata requests in flight at the same time
+        :param cache: The optional metadata cache to store the results in
+        :param library_id: The ID of the Content Library, required when a cache is given
+        :return: Iterator over the usable items as CLTemplate objects
+        """
+        concurrency = max(1, concurrency)
+        fetch = partial(self.fetch_cls_template, cache=cache, library_id=library_id)
+        pending = set()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='metadata') as executor:
+            for item in items:
+                if isinstance(item, CLTemplate):
+                    yield item
+                    continue
+                pending.add(executor.submit(fetch, item))
+                if len(pending) < 2 * concurrency:
+                    continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result() is not None:
+                        yield future.result()
+            for future in as_completed(pending):
+                if future.result() is not None:
+                    yield future.result()
 
 
 # Wrapper
-def create(api_host, api_user, api_pass) -> Optional[VCAPI]:
+def create(api_host, api_user, api_pass, pool_size: int = 10, retries: int = 3,
+           backoff: float = 0.5, rate_limiter: 'Optional[SharedRateLimiter]' = None,
+           cassette: 'Optional[Cassette]' = None, timeout: Tuple[float, float] = (10.0, 60.0),
+           streams: int = 1) -> Optional[VCAPI]:
     """
     Wrapper function to create an instance of the VCAPI class.
     :param api_host: The hostname of the vCenter server
     :param api_user: The username to authenticate
     :param api_pass: The password to authenticate
+    :param pool_size: The maximum number of keep-alive connections kept open to the vCenter server
+    :param retries: The number of retries of failed or throttled requests
+    :param backoff: The base delay in seconds of the exponential backoff between retries
+    :param rate_limiter: The optional rate limiter shared with other processes on this host
+    :param cassette: The optional cassette to record the requests to, or to replay them from
+    :param timeout: The connect and read timeouts of a request in seconds
+    :param streams: The number of listings streamed at the same time, each holding a connection of its own
     :return: An instance of the VCAPI class
     """
     # Check if all required parameters are set
     if not api_host or not api_user or not api_pass:
         log(sev='error', msg='Missing required parameters for vCenter API! Cannot proceed.')
         return None
-    return VCAPI(hostname=api_host, username=api_user, password=api_pass)
+    return VCAPI(hostname=api_host, username=api_user, password=api_pass, pool_size=pool_size,
+                 retry_policy=RetryPolicy(retries=max(0, retries), backoff=backoff), rate_limiter=rate_limiter,
+                 cassette=cassette, timeout=timeout, streams=streams)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import argparse
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+
+from api_vcenter import CLTemplate, parse_iso_datetime_utc
+from benchmark.mock_vcenter import generate_library
+
+
+# Previous representation of a template, kept here as baseline for comparison
+@dataclass
+class LegacyCLTemplate:
+    id: str = None
+    creation_time: datetime = None
+    last_modified_time: datetime = None
+    description: str = None
+    type: str = None
+    version: str = None
+    content_version: str = None
+    library_id: str = None
+    size: int = None
+    cached: bool = None
+    name: str = None
+    security_compliance: bool = None
+    metadata_version: str = None
+
+
+def build_legacy(metadata: dict) -> LegacyCLTemplate:
+    """
+    Build a template the way it was done before: eager timestamp parsing, all fields kept.
+    :param metadata: The metadata of the Content Library item
+    :return: The legacy template object
+    """
+    metadata = dict(metadata)
+    metadata['creation_time'] = parse_iso_datetime_utc(metadata['creation_time'])
+    metadata['last_modified_time'] = parse_iso_datetime_utc(metadata['last_modified_time'])
+    return LegacyCLTemplate(**metadata)
+
+
+def measure(name: str, build, library: dict[str, dict]) -> dict:
+    """
+    Measure the memory and time needed to build a template object for each item of the library.
+    :param name: The name of the representation
+    :param build: The function building a template from metadata
+    :param library: The metadata of all items
+    :return: The measurement as dict
+    """
+    # Timing without tracemalloc, it slows down every allocation
+    gc.collect()
+    started = time.perf_counter()
+    templates = [build(metadata) for metadata in library.values()]
+    elapsed = time.perf_counter() - started
+    del templates
+
+    gc.collect()
+    tracemalloc.start()
+    templates = [build(metadata) for metadata in library.values()]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del templates
+    return {'name': name, 'items': len(library), 'memory': current, 'peak': peak, 'time': elapsed}
+
+
+# Main code
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description='Memory benchmark of the template representation.')
+    parser.add_argument('--items', type=int, default=100000, help='Number of items to build')
+    args = parser.parse_args()
+
+    # Metadata dicts are generated up front, so only the template objects are measured
+    library = generate_library(items=args.items, template_ratio=1.0)
+    print('{:>10} | {:>8} | {:>12} | {:>12} | {:>10} | {:>8}'.format('Template', 'Items', 'Retained', 'Peak',
+                                                                    'Per item', 'Time [s]'))
+    for result in [measure('legacy', build_legacy, library), measure('slotted', CLTemplate.from_metadata, library)]:
+        print('{:>10} | {:>8} | {:>8} KiB | {:>8} KiB | {:>8} B | {:>8.3f}'.format(
+            result['name'], result['items'], result['memory'] // 1024, result['peak'] // 1024,
+            result['memory'] // result['items'], result['time']))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Settings
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+# Modules which must not be imported before any network work begins
+HEAVY_MODULES = ['requests', 'urllib3', 'http.server', 'cProfile', 'tracemalloc']
+
+
+def run_startup() -> tuple[float, float, list[str]]:
+    """
+    Run main.py without settings in a child process, so it exits right after startup, with import timing enabled.
+    :return: The wall time in seconds, the total import time in seconds and the names of the imported modules
+    """
+    env = {'PATH': os.environ.get('PATH', ''), 'PYTHONDONTWRITEBYTECODE': '1'}
+    started = time.monotonic()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', MAIN], cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE)
+    wall = time.monotonic() - started
+
+    # Lines look like 'import time:       248 |        428 |   journal', nested imports are indented
+    imported = 0
+    modules = []
+    for line in proc.stderr.decode(errors='replace').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append(name.strip())
+        if not name[1:].startswith(' '):
+            imported += int(cumulative)
+    return wall, imported / 1e6, modules
+
+
+# Main code
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description='Cold start benchmark of main.py, up to the first network work.')
+    parser.add_argument('--runs', type=int, default=10, help='Number of runs, the median is reported')
+    parser.add_argument('--max-wall', type=float, default=0.2,
+                        help='Maximum median wall time of a run in seconds, including interpreter startup')
+    parser.add_argument('--max-imports', type=float, default=0.12,
+                        help='Maximum median time spent importing modules in seconds')
+    args = parser.parse_args()
+
+    walls, imports, heavy = [], [], set()
+    for _ in range(args.runs):
+        wall, imported, modules = run_startup()
+        walls.append(wall)
+        imports.append(imported)
+        heavy.update(module for module in modules if module in HEAVY_MODULES)
+
+    wall, imported = statistics.median(walls), statistics.median(imports)
+    print('{:>10} | {:>12} | {:>12} | {}'.format('Runs', 'Wall [ms]', 'Imports [ms]', 'Heavy modules imported'))
+    print('{:>10} | {:>12.1f} | {:>12.1f} | {}'.format(args.runs, wall * 1000, imported * 1000,
+                                                       ', '.join(sorted(heavy)) or '-'))
+
+    # Fail if the cold start got slower than the bounds, e.g. through a new eager import
+    failures = []
+    if heavy:
+        failures.append('heavy modules imported at startup: {}'.format(', '.join(sorted(heavy))))
+    if wall > args.max_wall:
+        failures.append('wall time {:.1f}ms exceeds {:.1f}ms'.format(wall * 1000, args.max_wall * 1000))
+    if imported > args.max_imports:
+        failures.append('import time {:.1f}ms exceeds {:.1f}ms'.format(imported * 1000, args.max_imports * 1000))
+    for failure in failures:
+        print('FAILED: {}'.format(failure))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+
+# Settings
+# Prefix of the issued session tokens, followed by a random suffix
+SESSION_TOKEN = 'mock-session-'
+LIBRARY_NAME = 'bench-library'
+
+# Item endpoint, e.g. /api/content/library/item/91408a54-3932-4797-959f-5235b4d7cc90
+ITEM_PATH = re.compile(r'^/api/content/library/item/([^/]+)$')
+
+
+def generate_library(items: int, groups: int = 20, template_ratio: float = 0.8, seed: int = 42,
+                     library_id: str = None) -> dict[str, dict]:
+    """
+    Generate a synthetic Content Library with items named like packer builds: '<name> (<timestamp>)'.
+    :param items: The number of items in the library
+    :param groups: The number of distinct template names
+    :param template_ratio: The share of items which are of type vm-template, the rest are ISO/OVF items
+    :param seed: The seed of the random generator, to get reproducible libraries
+    :param library_id: The ID of the library the items belong to
+    :return: The metadata of all items as dict, keyed by item ID
+    """
+    rnd = random.Random(seed)
+    library_id = library_id or str(uuid.UUID(int=rnd.getrandbits(128)))
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    library = {}
+    for i in range(items):
+        item_id = str(uuid.UUID(int=rnd.getrandbits(128)))
+        created = start + timedelta(minutes=i * 7 + rnd.randint(0, 5))
+        is_template = rnd.random() < template_ratio
+        name = 'Ubuntu_{:02d}.04-Template'.format(i % groups) if is_template else 'ISO-Image-{:02d}'.format(i % groups)
+        timestamp = created.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(created.microsecond // 1000)
+        library[item_id] = {
+            'id': item_id,
+            'creation_time': timestamp,
+            'last_modified_time': timestamp,
+            'description': 'Synthetic item {} of the mock vCenter'.format(i),
+            'type': 'vm-template' if is_template else rnd.choice(['iso', 'ovf']),
+            'version': '1',
+            'content_version': '2',
+            'library_id': library_id,
+            'size': rnd.randint(1, 8) * 1024 ** 3 + rnd.randint(0, 1024 ** 2),
+            'cached': True,
+            'name': '{} ({})'.format(name, created.strftime('%Y%m%d%H%M')),
+            'security_compliance': True,
+            'metadata_version': '1',
+        }
+    return library
+
+
+# Mock vCenter server
+class MockVCenter:
+    """Local stand-in for the vCenter REST endpoints used by VCAPI."""
+
+    def __init__(self, items: int = 100, groups: int = 20, template_ratio: float = 0.8, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, item_find: bool = True, seed: int = 42):
+        """
+        Class initialization. Sets up the synthetic library and the server settings.
+        :param items: The number of items in the synthetic library
+        :param groups: The number of distinct template names
+        :param template_ratio: The share of items which are of type vm-template
+        :param latency: The latency added to each response, in seconds
+        :param jitter: The maximum random latency added on top, in seconds
+        :param error_rate: The share of item requests answered with 503 Service Unavailable
+        :param item_find: The flag to support filtering items via content/library/item?action=find
+        :param seed: The seed of the random generators
+        """
+        self.library_id = str(uuid.UUID(int=seed))
+        self.items = generate_library(items=items, groups=groups, template_ratio=template_ratio, seed=seed,
+                                      library_id=self.library_id)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.item_find = item_find
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.sessions: set[str] = set()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL of the running server, to be used as vCenter endpoint.
+        """
+        return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+    def count(self, endpoint: str) -> None:
+        """
+        Count a request per endpoint.
+        :param endpoint: The endpoint, e.g. 'GET content/library/item/{id}'
+        """
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def reset_counts(self) -> None:
+        """
+        Reset the request counters.
+        """
+        with self.lock:
+            self.counts = {}
+
+    def delay(self) -> None:
+        """
+        Simulate the configured latency.
+        """
+        if self.latency or self.jitter:
+            with self.lock:
+                jitter = self.random.uniform(0, self.jitter)
+            time.sleep(self.latency + jitter)
+
+    def fail(self) -> bool:
+        """
+        Decide whether to inject an error into the current request.
+        :return: True if the request should fail
+        """
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def handle(self, method: str, path: str, query: dict, body: Optional[dict], headers) -> tuple[int, object]:
+        """
+        Handle a single API request.
+        :param method: The HTTP method
+        :param path: The request path
+        :param query: The parsed query string
+        :param body: The parsed JSON body
+        :param headers: The request headers
+        :return: The status code and the JSON-serializable response body
+        """
+        if path == '/api/session':
+            self.count('{} session'.format(method))
+            if method == 'POST':
+                if not headers.get('Authorization', '').startswith('Basic '):
+                    return 401, {'error_type': 'UNAUTHENTICATED'}
+                with self.lock:
+                    token = '{}{:016x}'.format(SESSION_TOKEN, self.random.getrandbits(64))
+                    self.sessions.add(token)
+                return 201, token
+
+        # Everything else requires a valid session
+        token = headers.get('vmware-api-session-id')
+        with self.lock:
+            valid = token in self.sessions
+        if not valid:
+            return 401, {'error_type': 'UNAUTHENTICATED'}
+
+        if path == '/api/session':
+            if method == 'GET':
+                return 200, {'user': 'VSPHERE.LOCAL\\cleanup', 'created_time': datetime.now(timezone.utc).isoformat()}
+            if method == 'DELETE':
+                with self.lock:
+                    self.sessions.discard(token)
+                return 204, None
+
+        if path == '/api/content/library' and method == 'POST' and query.get('action') == ['find']:
+            self.count('POST content/library?action=find')
+            if (body or {}).get('name') == LIBRARY_NAME:
+                return 200, [self.library_id]
+            return 200, []
+
+        if path == '/api/content/library/item' and method == 'GET':
+            self.count('GET content/library/item')
+            if query.get('library_id') != [self.library_id]:
+                return 404, {'error_type': 'NOT_FOUND'}
+            with self.lock:
+                return 200, list(self.items)
+
+        if path == '/api/content/library/item' and method == 'POST' and query.get('action') == ['find']:
+            self.count('POST content/library/item?action=find')
+            if not self.item_find:
+                return 400, {'error_type': 'INVALID_ARGUMENT'}
+            spec = body or {}
+            with self.lock:
+                return 200, [item_id for item_id, item in self.items.items()
+                             if spec.get('library_id') in (None, item['library_id'])
+                             and spec.get('type') in (None, item['type'])]
+
+        match = ITEM_PATH.match(path)
+        if match and method in ('GET', 'DELETE'):
+            self.count('{} content/library/item/{{id}}'.format(method))
+            if self.fail():
+                return 503, {'error_type': 'SERVICE_UNAVAILABLE'}
+            with self.lock:
+                if match.group(1) not in self.items:
+                    return 404, {'error_type': 'NOT_FOUND'}
+                if method == 'DELETE':
+                    del self.items[match.group(1)]
+                    return 204, None
+                return 200, self.items[match.group(1)]
+
+        self.count('{} <unknown>'.format(method))
+        return 404, {'error_type': 'NOT_FOUND'}
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> 'MockVCenter':
+        """
+        Start the server in a background thread.
+        :param host: The address to listen on
+        :param port: The port to listen on, 0 picks a free port
+        :return: The instance itself
+        """
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like the real vCenter; without TCP_NODELAY small responses stall on delayed ACKs
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                url = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = json.loads(raw) if raw else None
+                mock.delay()
+                status, payload = mock.handle(method=self.command, path=url.path, query=parse_qs(url.query),
+                                              body=body, headers=self.headers)
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_DELETE = _dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-vcenter', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop the server.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+# Main code
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description='Local mock of the vCenter REST API used by vmw-cls-cleanup.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--items', type=int, default=100, help='Number of items in the synthetic library')
+    parser.add_argument('--groups', type=int, default=20, help='Number of distinct template names')
+    parser.add_argument('--template-ratio', type=float, default=0.8, help='Share of vm-template items')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latency per request in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Max. random extra latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of item requests failing with 503')
+    parser.add_argument('--no-item-find', action='store_true', help='Reject server-side filtering of items')
+    args = parser.parse_args()
+
+    server = MockVCenter(items=args.items, groups=args.groups, template_ratio=args.template_ratio,
+                         latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                         item_find=not args.no_item_find)
+    server.start(host=args.host, port=args.port)
+    print('Mock vCenter listening on {}, Content Library "{}" with {} items.'
+          .format(server.url, LIBRARY_NAME, len(server.items)))
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
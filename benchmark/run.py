@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmark.mock_vcenter import MockVCenter, LIBRARY_NAME
+
+# Settings
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+
+def run_main(url: str, env: dict[str, str]) -> tuple[int, float, int, str]:
+    """
+    Run the full main.py flow against the given endpoint in a child process.
+    :param url: The base URL of the mock vCenter
+    :param env: Additional environment variables for the run
+    :return: The exit code, wall time in seconds, peak RSS in KiB and the output of the run
+    """
+    child_env = dict(os.environ)
+    child_env.update({
+        'PKR_VAR_vsphere_endpoint': url,
+        'PKR_VAR_vsphere_username': 'bench@vsphere.local',
+        'PKR_VAR_vsphere_password': 'bench',
+        'PKR_VAR_vsphere_content_library': LIBRARY_NAME,
+    })
+    child_env.update(env)
+
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, MAIN], cwd=ROOT, env=child_env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.stdout.read().decode(errors='replace')
+    # wait4() gives us the resource usage of exactly this child
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.monotonic() - started
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, wall, usage.ru_maxrss, output
+
+
+def benchmark(items: int, args: argparse.Namespace, env: dict[str, str]) -> dict:
+    """
+    Run one benchmark against a fresh mock vCenter with a synthetic library.
+    :param items: The number of items in the synthetic library
+    :param args: The parsed command line arguments
+    :param env: Additional environment variables for the run
+    :return: The benchmark result as dict
+    """
+    mock = MockVCenter(items=items, groups=args.groups, template_ratio=args.template_ratio, latency=args.latency,
+                       jitter=args.jitter, error_rate=args.error_rate, item_find=not args.no_item_find).start()
+    try:
+        code, wall, rss, output = run_main(url=mock.url, env=env)
+        counts = dict(mock.counts)
+    finally:
+        mock.stop()
+
+    if code != 0 and args.verbose:
+        print(output)
+    return {
+        'items': items,
+        'exit_code': code,
+        'wall_time': round(wall, 3),
+        'peak_rss_kib': rss,
+        'requests': sum(counts.values()),
+        'requests_per_endpoint': counts,
+    }
+
+
+# Main code
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of vmw-cls-cleanup against a mock vCenter.')
+    parser.add_argument('--items', default='10,100,1000', help='Comma-separated library sizes to benchmark')
+    parser.add_argument('--groups', type=int, default=20, help='Number of distinct template names')
+    parser.add_argument('--template-ratio', type=float, default=0.8, help='Share of vm-template items')
+    parser.add_argument('--latency', type=float, default=0.005, help='Latency per request in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Max. random extra latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of item requests failing with 503')
+    parser.add_argument('--no-item-find', action='store_true', help='Reject server-side filtering of items')
+    parser.add_argument('--keep', type=int, default=3, help='Templates to keep per name')
+    parser.add_argument('--dry-run', action='store_true', help='Run the cleanup in dry-run mode')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Additional environment variable for main.py, can be repeated')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--verbose', action='store_true', help='Print the output of failed runs')
+    args = parser.parse_args()
+
+    env = {
+        'CLEANUP_SCRIPT_TEMPLATES_TO_KEEP': str(args.keep),
+        'CLEANUP_SCRIPT_DRY_RUN': 'true' if args.dry_run else 'false',
+    }
+    env.update(dict(pair.split('=', 1) for pair in args.env))
+
+    results = []
+    print('{:>8} | {:>4} | {:>9} | {:>12} | {:>8} | {}'.format('Items', 'Exit', 'Wall [s]', 'Peak RSS', 'Requests',
+                                                               'Requests per endpoint'))
+    for size in [int(i) for i in args.items.split(',')]:
+        result = benchmark(items=size, args=args, env=env)
+        results.append(result)
+        endpoints = ', '.join('{}: {}'.format(k, v) for k, v in sorted(result['requests_per_endpoint'].items()))
+        print('{:>8} | {:>4} | {:>9.3f} | {:>8} KiB | {:>8} | {}'.format(
+            result['items'], result['exit_code'], result['wall_time'], result['peak_rss_kib'], result['requests'],
+            endpoints))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'end-to-end', 'settings': vars(args), 'results': results}, f, indent=2)
+
+    exit(0 if all(r['exit_code'] == 0 for r in results) else 1)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+import gzip
+import json
+import threading
+import time
+from typing import Optional, TextIO
+from urllib.parse import urlsplit
+
+from requests import PreparedRequest, Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from logger import log
+
+# Version of the cassette format. Cassettes of another version can not be replayed.
+CASSETTE_VERSION = 1
+# Response headers kept in a cassette; all others, like cookies holding the session, are left out
+HEADERS = ('Content-Type', 'Retry-After')
+# Response body stored instead of the session token
+REDACTED = '"redacted"'
+
+
+# Cassette Class
+class Cassette:
+    """
+    Records all requests to the vCenter API with their responses and latencies to a cassette file, or replays them
+    from it without any vCenter, e.g. to compare the throughput and number of requests of a production run before
+    and after a change. Credentials are never written: request headers are left out, only a few response headers
+    are kept, and the session token is redacted.
+    The cassette is a JSON-lines file, gzip compressed if the path ends with '.gz'.
+    """
+
+    def __init__(self, path: str, mode: str = 'record', latency: float = 1.0):
+        """
+        Class initialization. Opens the cassette file right away.
+        :param path: The path of the cassette file
+        :param mode: 'record' to write a new cassette, 'replay' to serve the responses of an existing cassette
+        :param latency: The factor applied to the recorded latencies on replay, e.g. 0 to replay without delays
+        """
+        self.path = path
+        self.mode = mode
+        self.latency = max(0.0, latency)
+        self.lock = threading.Lock()
+        self.file: Optional[TextIO] = None
+        # Replay: recorded responses per request, served in recorded order; the last one is repeated
+        self.responses: dict[str, list[dict]] = {}
+        self.requests = 0
+        self.missing = 0
+
+        if mode == 'record':
+            self.file = self._open('wt')
+            self._write({'version': CASSETTE_VERSION, 'recorded': time.time()})
+        elif mode == 'replay':
+            self._load()
+        else:
+            log(sev='error', msg='Unknown cassette mode {}, must be record or replay.', args=(mode,))
+
+    def _open(self, mode: str) -> TextIO:
+        """
+        Helper function to open the cassette file, compressed or not.
+        :param mode: The file mode, 'rt' or 'wt'
+        :return: The open file
+        """
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode, encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    def _write(self, entry: dict) -> None:
+        """
+        Helper function to append an entry to the cassette.
+        :param entry: The entry to append
+        :return: None
+        """
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+
+    def _load(self) -> None:
+        """
+        Load the recorded responses of the cassette.
+        :return: None
+        """
+        try:
+            with self._open('rt') as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('version') != CASSETTE_VERSION:
+                    log(sev='error', msg='Cassette {} has an unsupported version.', args=(self.path,))
+                for line in f:
+                    entry = json.loads(line)
+                    self.responses.setdefault(self._key(entry['method'], entry['url'], entry['body']),
+                                              []).append(entry)
+        except (OSError, ValueError) as e:
+            log(sev='error', msg='Could not read cassette {}: {}', args=(self.path, e))
+        log(sev='info', msg='Replaying {} recorded requests from cassette {} at {}x latency.',
+            args=(sum(len(entries) for entries in self.responses.values()), self.path, self.latency))
+
+    @staticmethod
+    def _key(method: str, url: str, body: Optional[str]) -> str:
+        """
+        Helper function to identify a request: method, URL and body.
+        :param method: The HTTP method
+        :param url: The URL including the query
+        :param body: The request body, if any
+        :return: The key of the request
+        """
+        return '{} {} {}'.format(method, url, body or '')
+
+    @staticmethod
+    def _body(request: PreparedRequest) -> Optional[str]:
+        """
+        Helper function to get the body of a request as text.
+        :param request: The request
+        :return: The body, or None if there is none
+        """
+        body = request.body
+        return body.decode('utf-8', errors='replace') if isinstance(body, bytes) else body
+
+    def adapter(self, pool_maxsize: int) -> HTTPAdapter:
+        """
+        The transport adapter recording or replaying the requests, to mount on the HTTP session of the vCenter API.
+        :param pool_maxsize: The maximum number of keep-alive connections of the adapter
+        :return: The transport adapter
+        """
+        adapter_class = RecordingAdapter if self.mode == 'record' else ReplayAdapter
+        return adapter_class(cassette=self, pool_connections=1, pool_maxsize=pool_maxsize)
+
+    def record(self, request: PreparedRequest, response: Response, elapsed: float) -> None:
+        """
+        Record a request and its response. The body of a streamed response is read right away.
+        :param request: The request
+        :param response: The response
+        :param elapsed: The latency of the request in seconds, until the body was received
+        :return: None
+        """
+        text = response.text
+        if urlsplit(request.url).path.endswith('/api/session'):
+            text = REDACTED
+        self._write({'method': request.method, 'url': request.url, 'body': self._body(request),
+                     'status': response.status_code, 'reason': response.reason,
+                     'headers': {name: response.headers[name] for name in HEADERS if name in response.headers},
+                     'elapsed': round(elapsed, 6), 'response': text})
+        with self.lock:
+            self.requests += 1
+
+    def replay(self, request: PreparedRequest) -> Response:
+        """
+        Serve the recorded response of a request after its scaled latency. Requests which were not recorded get a
+        404 response.
+        :param request: The request
+        :return: The response
+        """
+        key = self._key(request.method, request.url, self._body(request))
+        with self.lock:
+            self.requests += 1
+            entries = self.responses.get(key)
+            entry = entries.pop(0) if entries and len(entries) > 1 else (entries[0] if entries else None)
+            if entry is None:
+                self.missing += 1
+        if entry is None:
+            log(sev='debug', msg='- Request {} {} is not recorded in the cassette.', args=(request.method, request.url))
+            entry = {'status': 404, 'reason': 'Not Recorded', 'headers': {}, 'elapsed': 0.0, 'response': ''}
+        if entry['elapsed'] * self.latency > 0:
+            time.sleep(entry['elapsed'] * self.latency)
+
+        response = Response()
+        response.status_code = entry['status']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        response._content = entry['response'].encode('utf-8')
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        """
+        Close the cassette file and log how many requests were recorded or replayed.
+        :return: None
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        if self.mode == 'record':
+            log(sev='info', msg='Recorded {} requests to cassette {}.', args=(self.requests, self.path))
+        else:
+            log(sev='info', msg='Replayed {} requests from cassette {}, {} of them not recorded.',
+                args=(self.requests, self.path, self.missing))
+
+
+# Recording Adapter Class
+class RecordingAdapter(HTTPAdapter):
+    """Transport adapter sending the requests as usual and recording them to a cassette."""
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        """
+        Class initialization.
+        :param cassette: The cassette to record to
+        :param kwargs: Further arguments for HTTPAdapter
+        """
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        started = time.perf_counter()
+        response = super().send(request, **kwargs)
+        # Read the body as part of the latency, also of streamed responses
+        _ = response.content
+        self.cassette.record(request=request, response=response, elapsed=time.perf_counter() - started)
+        return response
+
+
+# Replay Adapter Class
+class ReplayAdapter(HTTPAdapter):
+    """Transport adapter serving the requests from a cassette, without any connection."""
+
+    def __init__(self, cassette: Cassette, **kwargs):
+        """
+        Class initialization.
+        :param cassette: The cassette to replay from
+        :param kwargs: Further arguments for HTTPAdapter
+        """
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:
+        return self.cassette.replay(request=request)
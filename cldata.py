@@ -1,98 +1,271 @@
 #!/usr/bin/env python3
+import bisect
+import heapq
 import re
+from contextlib import nullcontext
+from typing import Iterable, Iterator, Optional, Union
 
 from api_vcenter import CLTemplate
-from logger import log
+from logger import log, enabled
+from deletion import format_size
+from metrics import metrics
 
+# Default naming scheme of the templates: '<name> (<unique value>)', the first group is the name to group by
+NAME_PATTERN = r"(.+?) \((\d+)\)"
 
-def extract_by_name(template: CLTemplate) -> tuple[str, CLTemplate]:
+
+def extract_by_name(template: CLTemplate, pattern: re.Pattern = re.compile(NAME_PATTERN)) -> Optional[str]:
     """
-    Helper function to extract the name and date from the template name, CLTemplate class as source.
+    Helper function to extract the name from the template name, CLTemplate class as source.
     :param template: The template object to extract the name from
-    :return: A tuple containing the extracted name and the template object
+    :param pattern: The precompiled name pattern, the first group is the name to group by
+    :return: The extracted name, or None if the template name does not follow the pattern
     """
     # Get the name (without the unique timestamp)
-    match = re.match(pattern=r"(.+?) \((\d+)\)", string=template.name)
-    name = match.group(1).replace("_", " ").strip()
-    log(sev='debug', msg=' Extracted name found: {}'.format(name))
-    # Return the name and template object
-    return name, template
+    match = pattern.match(template.name or '')
+    if match is None:
+        return None
+    return match.group(1).replace("_", " ").strip()
 
 
-def merge_by_name(templates: dict) -> dict[str, list[CLTemplate]]:
-    """
-    Helper function to merge the extracted templates by name.
-    :param templates: The list of templates to merge
-    :return: The merged list of templates grouped by extracted name
+# Retention Engine Class
+class RetentionEngine:
     """
-    log(sev='debug', msg='Merging templates by name...')
-    # Extract the name and date from the template name
-    extracted_templates = {}
-    for template in templates:
-        # Extract the name and template data
-        extract = extract_by_name(templates[template])
-        # Merge the extracted data with the existing list
-        if extract[0] not in extracted_templates:
-            extracted_templates[extract[0]] = []
-        # Append the template to the list
-        extracted_templates[extract[0]].append(extract[1])
-
-    # The final data is now structured like:
-    # {'name1': [CLTemplate, ...], ..., 'name2': [CLTemplate, ...]}
-
-    log(sev='debug', msg='Merging complete: {} unique templates found, {} total templates.'
-        .format(len(extracted_templates), len(templates)))
-    return extracted_templates
-
-
-def sort_by_creation_date(templates: dict[str, list[CLTemplate]]) -> dict[str, list[CLTemplate]]:
+    Streaming grouping and retention of templates. Keeps only the newest templates per name in a bounded heap,
+    every template pushed out of a heap is a deletion candidate. Runs in O(N log K) for N templates.
     """
-    Helper function to sort the templates by creation date.
-    :param templates: The list of templates to sort
-    :return: The sorted list of templates
-    """
-    log(sev='debug', msg='Sorting templates by creation date...')
-    # Sort the templates by creation date; newest first.
-    for template in templates:
-        templates[template].sort(key=lambda x: x.creation_time, reverse=True)
 
-    return templates
+    def __init__(self, keep: int, pattern: str = NAME_PATTERN):
+        """
+        Class initialization.
+        :param keep: The number of templates to keep per name
+        :param pattern: The name pattern, the first group is the name to group by
+        """
+        self.keep = max(1, keep)
+        self.pattern = re.compile(pattern)
+        # Per name: min-heap of (creation_ts, id, template) holding the newest templates, oldest on top
+        self.retained: dict[str, list[tuple]] = {}
+        # Per name: templates to delete
+        self.candidates: dict[str, list[CLTemplate]] = {}
+        # Templates not following the naming scheme; they are never deleted
+        self.ungrouped: list[CLTemplate] = []
+        self.total = 0
+
+    def add(self, template: CLTemplate) -> Optional[tuple[str, CLTemplate]]:
+        """
+        Add a template to the engine.
+        :param template: The template to add
+        :return: The name and template of a new deletion candidate, or None if there is none (yet)
+        """
+        self.total += 1
+        name = extract_by_name(template=template, pattern=self.pattern)
+        if name is None:
+            log(sev='warn', msg=' Template "{}" does not match the naming scheme, not touching it.',
+                args=(template.name,))
+            self.ungrouped.append(template)
+            return None
+        log(sev='debug', msg=' Extracted name found: {}', args=(name,))
+
+        if name not in self.retained:
+            self.retained[name] = []
+            self.candidates[name] = []
+        heap = self.retained[name]
+        entry = (template.creation_ts, template.id, template)
+        if len(heap) < self.keep:
+            heapq.heappush(heap, entry)
+            return None
+
+        # Heap is full: whichever is older, the new template or the oldest retained one, is to be deleted
+        evicted = heapq.heappushpop(heap, entry)[2]
+        self.candidates[name].append(evicted)
+        return name, evicted
+
+    def feed(self, templates: Iterable[CLTemplate]) -> Iterator[tuple[str, CLTemplate]]:
+        """
+        Add many templates to the engine and emit deletion candidates as soon as they are known.
+        :param templates: The templates to add
+        :return: Iterator over name and template of each deletion candidate
+        """
+        for template in templates:
+            candidate = self.add(template=template)
+            if candidate is not None:
+                yield candidate
 
+    def kept(self) -> dict[str, list[CLTemplate]]:
+        """
+        The templates to keep per name.
+        :return: The templates to keep grouped by extracted name, newest first
+        """
+        return {name: [entry[2] for entry in sorted(heap, reverse=True)] for name, heap in self.retained.items()}
 
-def convert(templates: dict) -> dict[str, list[CLTemplate]]:
+    def to_delete(self) -> dict[str, list[CLTemplate]]:
+        """
+        The templates to delete per name.
+        :return: The templates to delete grouped by extracted name, newest first
+        """
+        return {name: sorted(templates, key=lambda x: (x.creation_ts, x.id), reverse=True)
+                for name, templates in self.candidates.items()}
+
+
+# Template Index Class
+class TemplateIndex:
     """
-    Main function to take care about data conversion. Convert the templates to a list of tuples.
-    :param templates: The list of templates to convert
-    :return: The converted and processed list of templates in form of a list of tuples: (name, [CLTemplate, ...])
+    Incremental grouping and retention for long-running use. Holds all templates of a library grouped by name and
+    sorted by creation time, and tracks the names changed since the last evaluation, so only those are re-evaluated.
     """
-    log(sev='debug', msg='Converting template data...')
-    # Extract the name and date from the template name
-    data = merge_by_name(templates=templates)
-    # Sort the templates by creation date
-    data = sort_by_creation_date(templates=data)
-    # Return the final data
-    return data
+
+    def __init__(self, keep: int, pattern: str = NAME_PATTERN):
+        """
+        Class initialization.
+        :param keep: The number of templates to keep per name
+        :param pattern: The name pattern, the first group is the name to group by
+        """
+        self.keep = max(1, keep)
+        self.pattern = re.compile(pattern)
+        # Per item ID: extracted name (None if not following the naming scheme) and template
+        self.templates: dict[str, tuple[Optional[str], CLTemplate]] = {}
+        # Per name: templates sorted by (creation_ts, id), oldest first
+        self.groups: dict[str, list[CLTemplate]] = {}
+        # Names changed since the last evaluation
+        self.dirty: set[str] = set()
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.templates
+
+    def add(self, template: CLTemplate) -> None:
+        """
+        Add a template to the index. A template known already replaces the previous one.
+        :param template: The template to add
+        :return: None
+        """
+        if template.id in self.templates:
+            self.remove(item_id=template.id)
+        name = extract_by_name(template=template, pattern=self.pattern)
+        self.templates[template.id] = (name, template)
+        if name is None:
+            log(sev='warn', msg=' Template "{}" does not match the naming scheme, not touching it.',
+                args=(template.name,))
+            return
+        bisect.insort(self.groups.setdefault(name, []), template, key=lambda x: (x.creation_ts, x.id))
+        self.dirty.add(name)
+
+    def remove(self, item_id: str) -> None:
+        """
+        Remove a template from the index, e.g. after it was deleted.
+        :param item_id: The ID of the template
+        :return: None
+        """
+        name, template = self.templates.pop(item_id, (None, None))
+        if name is None:
+            return
+        self.groups[name].remove(template)
+        if not self.groups[name]:
+            del self.groups[name]
+
+    def evaluate(self) -> dict[str, list[CLTemplate]]:
+        """
+        Re-evaluate the retention of all names changed since the last evaluation.
+        :return: The templates to delete grouped by extracted name, newest first
+        """
+        templates = {}
+        for name in self.dirty:
+            group = self.groups.get(name, [])
+            if len(group) > self.keep:
+                templates[name] = group[-self.keep - 1::-1]
+        self.dirty.clear()
+        return templates
 
 
-def templates_to_delete(templates: dict[str, list[CLTemplate]], keep: int) -> dict[str, list[CLTemplate]]:
+def templates_to_delete(templates: Union[dict, Iterable[CLTemplate]], keep: int,
+                        pattern: str = NAME_PATTERN) -> dict[str, list[CLTemplate]]:
     """
     Function to determine which templates to delete based on the number of templates to keep.
-    :param templates: The list of templates to process
+    :param templates: The templates to process as dict of CLTemplate objects, or as stream of CLTemplate objects
     :param keep: The number of templates to keep
+    :param pattern: The name pattern, the first group is the name to group by
     :return: The list of templates to delete
     """
     log(sev='info', msg='Determining templates to delete...')
-    # Delete the first x templates based on the 'keep' value
-    # To keep them, we need to delete the amount we want to keep from the top of the list
-    # This is because the list is sorted by creation date, newest first.
-    for name in templates:
-        len_old = len(templates[name])
-        del templates[name][:keep]
-        log(sev='info', msg=' Keeping {} templates for "{}" [before: {}, after: {}].'
-            .format(keep, name, len_old, len(templates[name])))
+    engine = RetentionEngine(keep=keep, pattern=pattern)
+    # Grouping a stream happens while it is retrieved; only a dict is grouped in a phase of its own
+    with metrics.phase('convert') if isinstance(templates, dict) else nullcontext():
+        for template in templates.values() if isinstance(templates, dict) else templates:
+            engine.add(template=template)
+    log_retention(engine=engine)
+    # Output the templates to be kept if debug is enabled
+    if enabled('debug'):
+        log(sev='debug', msg='Final data of templates to be kept:')
+        print_list(templates=engine.kept())
 
     # Return the list of templates to delete
-    return templates
+    return engine.to_delete()
+
+
+def templates_over_budget(templates: Union[dict, Iterable[CLTemplate]], budget: int, keep: int,
+                          pattern: str = NAME_PATTERN, scope: str = 'library') -> dict[str, list[CLTemplate]]:
+    """
+    Function to determine which templates to delete to get the used storage below a byte budget. The oldest templates
+    are deleted first, but at least the given number of templates is kept per name.
+    :param templates: The templates to process as dict of CLTemplate objects, or as stream of CLTemplate objects
+    :param budget: The storage budget in bytes
+    :param keep: The minimum number of templates to keep per name
+    :param pattern: The name pattern, the first group is the name to group by
+    :param scope: The scope of the budget, either the whole library ('library') or each name ('group')
+    :return: The list of templates to delete
+    """
+    log(sev='info', msg='Determining templates to delete to stay within {} per {}...',
+        args=(format_size(budget), 'library' if scope == 'library' else 'template name'))
+    index = TemplateIndex(keep=keep, pattern=pattern)
+    selected: dict[str, list[CLTemplate]] = {}
+    with metrics.phase('convert') if isinstance(templates, dict) else nullcontext():
+        for template in templates.values() if isinstance(templates, dict) else templates:
+            index.add(template=template)
+
+    with metrics.phase('convert'):
+        # Per name: the templates eligible for deletion, all but the newest ones to keep, oldest first
+        eligible = {name: [(template.creation_ts, template.id, name, template) for template in group[:-index.keep]]
+                    for name, group in index.groups.items()}
+        if scope == 'group':
+            pools = [(name, [eligible[name]], sum(template.size or 0 for template in index.groups[name]))
+                     for name in index.groups]
+        else:
+            # Templates not following the naming scheme are never deleted, but still use storage
+            pools = [('library', list(eligible.values()),
+                      sum(template.size or 0 for _, template in index.templates.values()))]
+
+        for label, groups, used in pools:
+            before = used
+            # Merge the sorted lists lazily, the selection stops as soon as the budget is met
+            for _, _, name, template in heapq.merge(*groups):
+                if used <= budget:
+                    break
+                selected.setdefault(name, []).append(template)
+                used -= template.size or 0
+            log(sev='info', msg=' Storage of "{}": {} used, {} to reclaim, {} afterward.',
+                args=(label, format_size(before), format_size(before - used), format_size(used)))
+            if used > budget:
+                log(sev='warn', msg=' Storage of "{}" stays above the budget, keeping at least {} templates per name.',
+                    args=(label, index.keep))
+
+    log(sev='info', msg='Projected to reclaim {} by deleting {} templates.',
+        args=(format_size(sum(template.size or 0 for group in selected.values() for template in group)),
+              sum(len(group) for group in selected.values())))
+    # Return the list of templates to delete, newest first like templates_to_delete()
+    return {name: selected[name][::-1] for name in index.groups if name in selected}
+
+
+def log_retention(engine: RetentionEngine) -> None:
+    """
+    Helper function to log the outcome of the retention per name.
+    :param engine: The retention engine holding the templates
+    """
+    log(sev='debug', msg='Grouping complete: {} unique templates found, {} total templates, {} ungrouped.',
+        args=(len(engine.retained), engine.total, len(engine.ungrouped)))
+    for name in engine.retained:
+        kept = len(engine.retained[name])
+        deleted = len(engine.candidates[name])
+        log(sev='info', msg=' Keeping {} templates for "{}" [before: {}, after: {}].',
+            args=(engine.keep, name, kept + deleted, deleted))
 
 
 def print_list(templates: dict[str, list[CLTemplate]]) -> None:
@@ -100,9 +273,10 @@ def print_list(templates: dict[str, list[CLTemplate]]) -> None:
     Helper function to print the list of templates.
     :param templates: The list of templates to print
     """
+    if not enabled('debug'):
+        return
     for name in templates:
-        log(sev='debug', msg=' Name: {} [{}]'.format(name, len(templates[name])))
+        log(sev='debug', msg=' Name: {} [{}]', args=(name, len(templates[name])))
         for template in templates[name]:
-            creation_date = template.creation_time.strftime('%Y-%m-%d %H:%M:%S %Z')
-            log(sev='debug', msg='  Template: {} / CreationTime: {}'
-                .format(template.name, creation_date))
+            log(sev='debug', msg='  Template: {0.name} / CreationTime: {0.creation_time:%Y-%m-%d %H:%M:%S %Z}',
+                args=(template,))
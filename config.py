@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+from dataclasses import dataclass
+from os import environ
+from typing import Mapping, Optional
+
+from cldata import NAME_PATTERN
+from deletion import parse_size
+from targets import Target
+
+# Modes: run plans and deletes in one go, plan only writes the deletion plan, apply only deletes the planned
+# templates, daemon watches the Content Libraries
+MODES = ('run', 'plan', 'apply', 'daemon')
+
+
+def _flag(env: Mapping[str, str], name: str, default: str) -> bool:
+    """
+    Helper function to read a boolean setting.
+    :param env: The environment
+    :param name: The name of the environment variable
+    :param default: The default value, 'true' or 'false'
+    :return: True if the setting is 'true', case-insensitive
+    """
+    return env.get(name, default).lower() == 'true'
+
+
+# Config object
+@dataclass
+class Config:
+    """
+    Dataclass to hold all settings of a run, read once from the environment at startup.
+    """
+    # vCenter API and generic settings from packer env
+    api_host: Optional[str] = None
+    api_user: Optional[str] = None
+    api_pass: Optional[str] = None
+    content_library: Optional[str] = None
+    insecure_api: bool = True
+
+    # Cleanup-specific settings
+    dry_run: bool = False
+    templates_to_keep: int = 1
+    name_pattern: str = NAME_PATTERN
+    delete_concurrency: int = 4
+    delete_ordered: bool = False
+    metadata_cache_path: str = ''
+    server_filter: bool = True
+    fetch_concurrency: int = 8
+    pool_size: int = 10
+    metrics_json_path: str = ''
+    metrics_prometheus_path: str = ''
+    retries: int = 3
+    retry_backoff: float = 0.5
+    # Seconds to wait for a connection to the vCenter, and for data of a response, before the request is retried
+    connect_timeout: float = 10
+    request_timeout: float = 60
+    mode: str = 'run'
+    plan_file: str = 'cleanup-plan.json'
+    # Content Libraries to clean up in one run, as JSON list or path to a JSON file; defaults to the PKR_VAR_* target
+    targets_config: str = ''
+    target_concurrency: int = 4
+    # Reuse vCenter sessions across runs: sessions are kept open and their tokens cached in this file
+    session_cache_path: str = ''
+    session_cache_ttl: int = 1500
+    # Daemon mode: seconds between two polls, and the optional local port to trigger a poll right away
+    poll_interval: float = 300
+    trigger_port: int = 0
+    # Checkpoint journal to resume an interrupted run from
+    journal_path: str = ''
+    # Time budget of the run in seconds; deletions which would not finish in time are skipped, the largest go first
+    time_budget: float = 0
+    # Storage budget in bytes: delete the oldest templates until the library (or each name) uses less, keeping at
+    # least templates_to_keep per name
+    storage_budget: Optional[int] = None
+    storage_budget_scope: str = 'library'
+    # Requests per second per vCenter, shared by all cleanup processes on this host using the same lock file
+    rate_limit: float = 0
+    rate_limit_burst: int = 1
+    rate_limit_file: str = '/tmp/vmw-cls-cleanup.ratelimit'
+    # Profile each phase with cProfile and tracemalloc, writing the results to this directory; tracing more frames
+    # per allocation shows the callers, but slows the run down a lot more
+    profile_dir: str = ''
+    profile_frames: int = 1
+    # Record all vCenter API requests to this cassette file, or replay them from it; latencies are scaled on replay
+    cassette_path: str = ''
+    cassette_mode: str = 'record'
+    cassette_latency: float = 1.0
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str] = environ) -> 'Config':
+        """
+        Read the settings from the environment variables.
+        :param env: The environment, the process environment by default
+        :return: The Config object
+        """
+        fetch_concurrency = max(1, int(env.get('CLEANUP_SCRIPT_FETCH_CONCURRENCY', 8)))
+        delete_concurrency = max(1, int(env.get('CLEANUP_SCRIPT_DELETE_CONCURRENCY', 4)))
+        storage_budget = env.get('CLEANUP_SCRIPT_STORAGE_BUDGET', '')
+        return cls(
+            api_host=env.get('PKR_VAR_vsphere_endpoint'),
+            api_user=env.get('PKR_VAR_vsphere_username'),
+            api_pass=env.get('PKR_VAR_vsphere_password'),
+            content_library=env.get('PKR_VAR_vsphere_content_library'),
+            insecure_api=_flag(env, 'PKR_VAR_vsphere_insecure_connection', 'true'),
+            dry_run=_flag(env, 'CLEANUP_SCRIPT_DRY_RUN', 'false'),
+            templates_to_keep=max(1, int(env.get('CLEANUP_SCRIPT_TEMPLATES_TO_KEEP', 1))),
+            name_pattern=env.get('CLEANUP_SCRIPT_NAME_PATTERN', NAME_PATTERN),
+            delete_concurrency=delete_concurrency,
+            delete_ordered=_flag(env, 'CLEANUP_SCRIPT_DELETE_ORDERED', 'false'),
+            metadata_cache_path=env.get('CLEANUP_SCRIPT_METADATA_CACHE', ''),
+            server_filter=_flag(env, 'CLEANUP_SCRIPT_SERVER_FILTER', 'true'),
+            fetch_concurrency=fetch_concurrency,
+            # Keep at least one pooled connection per concurrent request, otherwise connections get discarded
+            pool_size=max(int(env.get('CLEANUP_SCRIPT_POOL_SIZE', 10)), fetch_concurrency, delete_concurrency),
+            metrics_json_path=env.get('CLEANUP_SCRIPT_METRICS_JSON', ''),
+            metrics_prometheus_path=env.get('CLEANUP_SCRIPT_METRICS_PROMETHEUS', ''),
+            retries=int(env.get('CLEANUP_SCRIPT_RETRIES', 3)),
+            retry_backoff=float(env.get('CLEANUP_SCRIPT_RETRY_BACKOFF', 0.5)),
+            connect_timeout=float(env.get('CLEANUP_SCRIPT_CONNECT_TIMEOUT', 10)),
+            request_timeout=float(env.get('CLEANUP_SCRIPT_REQUEST_TIMEOUT', 60)),
+            mode=env.get('CLEANUP_SCRIPT_MODE', 'run').lower(),
+            plan_file=env.get('CLEANUP_SCRIPT_PLAN_FILE', 'cleanup-plan.json'),
+            targets_config=env.get('CLEANUP_SCRIPT_TARGETS', ''),
+            target_concurrency=max(1, int(env.get('CLEANUP_SCRIPT_TARGET_CONCURRENCY', 4))),
+            session_cache_path=env.get('CLEANUP_SCRIPT_SESSION_CACHE', ''),
+            session_cache_ttl=int(env.get('CLEANUP_SCRIPT_SESSION_CACHE_TTL', 1500)),
+            poll_interval=max(1.0, float(env.get('CLEANUP_SCRIPT_POLL_INTERVAL', 300))),
+            trigger_port=int(env.get('CLEANUP_SCRIPT_TRIGGER_PORT', 0)),
+            journal_path=env.get('CLEANUP_SCRIPT_JOURNAL', ''),
+            time_budget=float(env.get('CLEANUP_SCRIPT_TIME_BUDGET', 0)),
+            storage_budget=parse_size(storage_budget) if storage_budget else None,
+            storage_budget_scope=env.get('CLEANUP_SCRIPT_STORAGE_BUDGET_SCOPE', 'library').lower(),
+            rate_limit=float(env.get('CLEANUP_SCRIPT_RATE_LIMIT', 0)),
+            rate_limit_burst=int(env.get('CLEANUP_SCRIPT_RATE_LIMIT_BURST', 1)),
+            rate_limit_file=env.get('CLEANUP_SCRIPT_RATE_LIMIT_FILE', '/tmp/vmw-cls-cleanup.ratelimit'),
+            profile_dir=env.get('CLEANUP_SCRIPT_PROFILE', ''),
+            profile_frames=max(1, int(env.get('CLEANUP_SCRIPT_PROFILE_FRAMES', 1))),
+            cassette_path=env.get('CLEANUP_SCRIPT_CASSETTE', ''),
+            cassette_mode=env.get('CLEANUP_SCRIPT_CASSETTE_MODE', 'record').lower(),
+            cassette_latency=float(env.get('CLEANUP_SCRIPT_CASSETTE_LATENCY', 1.0)),
+        )
+
+    @property
+    def default_target(self) -> Target:
+        """
+        The target configured by the PKR_VAR_* environment variables.
+        """
+        return Target(endpoint=self.api_host, library=self.content_library, keep=self.templates_to_keep,
+                      budget=self.storage_budget, username=self.api_user, password=self.api_pass,
+                      insecure=self.insecure_api)
+
+    def missing(self) -> list[str]:
+        """
+        The names of required environment variables which are not set. Without a targets config, the default
+        target needs an endpoint, credentials and, unless the Content Libraries come from the plan, a Content Library.
+        :return: The names of the missing environment variables, empty if the config is complete
+        """
+        if self.targets_config:
+            return []
+        required = {'PKR_VAR_vsphere_endpoint': self.api_host, 'PKR_VAR_vsphere_username': self.api_user,
+                    'PKR_VAR_vsphere_password': self.api_pass}
+        if self.mode != 'apply':
+            required['PKR_VAR_vsphere_content_library'] = self.content_library
+        return [name for name, value in required.items() if not value]
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+import deletion
+from api_vcenter import VCAPI
+from cldata import TemplateIndex, print_list
+from logger import log, log_exception, enabled
+from metadata_cache import MetadataCache
+from metrics import metrics
+from targets import Target
+
+
+# Watched Library Class
+class WatchedLibrary:
+    """In-memory state of a Content Library watched in daemon mode."""
+
+    def __init__(self, api: VCAPI, target: Target, pattern: str):
+        """
+        Class initialization. The state is empty until the first poll.
+        :param api: The logged in vCenter API instance of the endpoint of the target
+        :param target: The target
+        :param pattern: The name pattern, the first group is the name to group by
+        """
+        self.api = api
+        self.target = target
+        self.library_id: Optional[str] = None
+        self.index = TemplateIndex(keep=target.keep, pattern=pattern)
+        # Dry-run: templates reported for deletion already; still listed, but neither fetched nor reported again
+        self.reported: set[str] = set()
+
+
+# Daemon Class
+class Daemon:
+    """
+    Long-running cleanup: polls the item listing of the watched Content Libraries on an interval, retrieves metadata
+    only for items which appeared since the last poll, and re-evaluates the retention of the changed names only.
+    A poll can be triggered right away by SIGUSR1 or a POST request to the optional local trigger endpoint.
+    """
+
+    def __init__(self, libraries: list[WatchedLibrary], cache: MetadataCache, interval: float = 300,
+                 fetch_concurrency: int = 8, delete_concurrency: int = 4, delete_ordered: bool = False,
+                 dry_run: bool = False, after_poll: Optional[Callable[[], None]] = None):
+        """
+        Class initialization.
+        :param libraries: The watched Content Libraries
+        :param cache: The metadata cache, remembering items which are no vm-templates; may be an in-memory cache
+        :param interval: The time between two polls, in seconds
+        :param fetch_concurrency: The maximum number of metadata requests in flight at the same time
+        :param delete_concurrency: The maximum number of deletions running at the same time
+        :param delete_ordered: The flag to delete the templates of a group strictly one after another
+        :param dry_run: The flag to skip sending the deletion requests
+        :param after_poll: Optional function called after each poll, e.g. to export metrics
+        """
+        self.libraries = libraries
+        self.cache = cache
+        self.interval = interval
+        self.fetch_concurrency = fetch_concurrency
+        self.delete_concurrency = delete_concurrency
+        self.delete_ordered = delete_ordered
+        self.dry_run = dry_run
+        self.after_poll = after_poll
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    # Triggers
+    def trigger(self, *_) -> None:
+        """
+        Poll right away instead of waiting for the interval. Usable as signal handler.
+        :return: None
+        """
+        self.wakeup.set()
+
+    def stop(self, *_) -> None:
+        """
+        Stop the daemon after the current poll. Usable as signal handler.
+        :return: None
+        """
+        self.stopping = True
+        self.wakeup.set()
+
+    def serve_trigger(self, port: int, host: str = '127.0.0.1') -> None:
+        """
+        Start the local trigger endpoint: a POST request to /trigger polls right away.
+        :param port: The port to listen on
+        :param host: The address to listen on, only the local host by default
+        :return: None
+        """
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status = 404
+                if self.path == '/trigger':
+                    log(sev='info', msg='Poll triggered via {}.', args=(self.path,))
+                    daemon.trigger()
+                    status = 202
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='trigger', daemon=True).start()
+        log(sev='info', msg='Listening for triggers on http://{}:{}/trigger.', args=(host, port))
+
+    # Polling
+    def poll(self, library: WatchedLibrary) -> None:
+        """
+        Update the state of a Content Library and delete the templates exceeding the retention.
+        :param library: The watched Content Library
+        :return: None
+        """
+        api, index = library.api, library.index
+        if library.library_id is None:
+            # First poll: retrieve everything like a single run, streamed into the index
+            for template in api.iter_cls_templates(library=library.target.library,
+                                                   concurrency=self.fetch_concurrency, cache=self.cache):
+                index.add(template=template)
+            library.library_id = api.library_ids[library.target.library]
+        else:
+            with metrics.phase('listing'):
+                listing = api.get_library_items(library_id=library.library_id)
+            if listing is None:
+                log(sev='error', msg='Error occurred while retrieving Content Library items.')
+
+            # Forget the items which are gone, and retrieve metadata only for the new ones
+            listed = set(listing)
+            for item_id in [item_id for item_id in index.templates if item_id not in listed]:
+                index.remove(item_id=item_id)
+            library.reported &= listed
+            self.cache.prune(library_id=library.library_id, item_ids=listing)
+            new = [item_id for item_id in listing
+                   if item_id not in index and item_id not in library.reported
+                   and not self.cache.is_skipped(library_id=library.library_id, item_id=item_id)]
+            if new:
+                log(sev='info', msg='{}: {} new items.', args=(library.target.label, len(new)))
+                with metrics.phase('metadata_fetch'):
+                    fetched = api.fetch_cls_templates(item_ids=new, concurrency=self.fetch_concurrency,
+                                                      cache=self.cache, library_id=library.library_id)
+                for template in fetched.values():
+                    index.add(template=template)
+
+        templates = index.evaluate()
+        if not templates:
+            return
+        if enabled('debug'):
+            log(sev='debug', msg='Templates to be deleted in {}:', args=(library.target.label,))
+            print_list(templates=templates)
+        with metrics.phase('delete'):
+            results = deletion.delete_templates(api=api, templates=templates, concurrency=self.delete_concurrency,
+                                                ordered=self.delete_ordered, dry_run=self.dry_run)
+        deletion.print_summary(results=results, dry_run=self.dry_run)
+        for result in results:
+            if result.success:
+                index.remove(item_id=result.template.id)
+                if self.dry_run:
+                    # The template stays listed; remember it, so it is not fetched and reported again
+                    library.reported.add(result.template.id)
+            else:
+                # Evaluate the name again on the next poll, so the deletion is retried
+                index.dirty.add(result.group)
+
+    def run(self) -> None:
+        """
+        Poll until stopped by SIGTERM or SIGINT. A failing poll of a library is logged and the library is polled
+        again on the next interval, after a new login.
+        :return: None
+        """
+        signal.signal(signal.SIGUSR1, self.trigger)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        log(sev='info', msg='Watching {} Content Libraries, polling every {}s.',
+            args=(len(self.libraries), self.interval))
+
+        while not self.stopping:
+            self.wakeup.clear()
+            for library in self.libraries:
+                try:
+                    self.poll(library=library)
+                except Exception as e:
+                    # The session may have expired, so login again for the next poll
+                    log_exception(msg='Poll of {} failed: {}. Logging in again...', args=(library.target.label, e))
+                    try:
+                        library.api.login()
+                    except Exception as e:
+                        log_exception(msg='Login to {} failed: {}', args=(library.target.endpoint, e))
+            if self.after_poll is not None:
+                self.after_poll()
+            self.wakeup.wait(timeout=self.interval)
+
+        log(sev='info', msg='Stopping daemon...')
+        if self.server is not None:
+            self.server.shutdown()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from api_vcenter import VCAPI, CLTemplate
+from logger import log
+
+if TYPE_CHECKING:
+    from journal import Journal
+
+
+# Deletion result object
+@dataclass
+class DeletionResult:
+    """
+    Dataclass to hold the outcome of a single deletion of a Content Library item.
+    """
+    group: str  # 'Ubuntu 24.04-Template'
+    template: CLTemplate
+    success: bool = False
+    error: Optional[str] = None
+    duration: float = 0.0  # seconds
+    skipped: bool = False  # not started, the time budget was exhausted
+
+
+# Deadline Class
+class Deadline:
+    """
+    Time budget of the deletions: a deletion is only started if it is expected to finish before the deadline, judged
+    by the longest deletion so far.
+    """
+
+    def __init__(self, at: float):
+        """
+        Class initialization.
+        :param at: The deadline, as time.monotonic() value
+        """
+        self.at = at
+        self.longest = 0.0
+        self.lock = threading.Lock()
+
+    def allows(self) -> bool:
+        """
+        Check if there is enough time left to start another deletion.
+        :return: True if a deletion started now is expected to finish in time
+        """
+        with self.lock:
+            return time.monotonic() + self.longest < self.at
+
+    def record(self, seconds: float) -> None:
+        """
+        Record the duration of a finished deletion.
+        :param seconds: The duration of the deletion
+        :return: None
+        """
+        with self.lock:
+            self.longest = max(self.longest, seconds)
+
+
+def format_size(size: Optional[int]) -> str:
+    """
+    Helper function to format a size in bytes in a human-readable way.
+    :param size: The size in bytes
+    :return: The formatted size, e.g. '5.61 GiB'
+    """
+    size = size or 0
+    if size < 1024:
+        return '{} B'.format(size)
+    for unit in ['KiB', 'MiB', 'GiB', 'TiB']:
+        size /= 1024
+        if size < 1024 or unit == 'TiB':
+            return '{:.2f} {}'.format(size, unit)
+
+
+def parse_size(value: str) -> int:
+    """
+    Helper function to parse a size with an optional unit, e.g. '500GiB', '1.5 TB' or '1024'.
+    :param value: The size; decimal (KB, MB, GB, TB) and binary (KiB, MiB, GiB, TiB) units are supported
+    :return: The size in bytes
+    """
+    units = {'': 1, 'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+             'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4}
+    match = re.fullmatch(r'\s*([0-9]+(?:\.[0-9]+)?)\s*([A-Za-z]*)\s*', value)
+    if match is None or match.group(2).upper() not in units:
+        raise ValueError('Invalid size: {}'.format(value))
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+
+def delete_template(api: VCAPI, group: str, template: CLTemplate, dry_run: bool = False,
+                    deadline: Optional[Deadline] = None, journal: 'Optional[Journal]' = None) -> DeletionResult:
+    """
+    Delete a single template. In dry-run mode no deletion request is sent, but the item still passes the executor.
+    :param api: The vCenter API instance
+    :param group: The name of the template group the template belongs to
+    :param template: The template to delete
+    :param dry_run: The flag to skip sending the deletion request
+    :param deadline: The optional time budget; the deletion is skipped if it would not finish in time
+    :param journal: The optional journal to record the completed deletion in
+    :return: The result of the deletion
+    """
+    result = DeletionResult(group=group, template=template)
+    if deadline is not None and not deadline.allows():
+        log(sev='debug', msg='  Skipping template {}, the time budget is exhausted.', args=(template.id,))
+        result.skipped, result.error = True, 'time budget exhausted'
+        return result
+    log(sev='info', msg='  Deleting template "{}" with ID {}...', args=(template.name, template.id))
+    started = time.monotonic()
+    try:
+        if dry_run:
+            result.success = True
+        else:
+            result.success, result.error = api.delete_library_item(item_id=template.id)
+    except Exception as e:
+        # A failed deletion must not abort the other deletions in flight
+        result.success, result.error = False, str(e)
+    result.duration = time.monotonic() - started
+    if deadline is not None:
+        deadline.record(seconds=result.duration)
+
+    if dry_run:
+        return result
+    if result.success:
+        log(sev='info', msg='   Successfully deleted template {}.', args=(template.id,))
+        if journal is not None:
+            journal.deleted(library_id=template.library_id, item_id=template.id)
+    else:
+        log(sev='warn', msg='   Error occurred while deleting template {}: {}.', args=(template.id, result.error))
+    return result
+
+
+def delete_group(api: VCAPI, group: str, templates: list[CLTemplate], dry_run: bool = False,
+                 deadline: Optional[Deadline] = None, journal: 'Optional[Journal]' = None) -> list[DeletionResult]:
+    """
+    Delete all templates of a template group one after another, in the given order.
+    :param api: The vCenter API instance
+    :param group: The name of the template group
+    :param templates: The templates to delete
+    :param dry_run: The flag to skip sending the deletion requests
+    :param deadline: The optional time budget; deletions which would not finish in time are skipped
+    :param journal: The optional journal to record the completed deletions in
+    :return: The results of the deletions
+    """
+    log(sev='info', msg=' Cleaning up template "{}"...', args=(group,))
+    return [delete_template(api=api, group=group, template=template, dry_run=dry_run, deadline=deadline,
+                            journal=journal) for template in templates]
+
+
+def delete_templates(api: VCAPI, templates: dict[str, list[CLTemplate]], concurrency: int = 4,
+                     ordered: bool = False, dry_run: bool = False, deadline: Optional[Deadline] = None,
+                     journal: 'Optional[Journal]' = None) -> list[DeletionResult]:
+    """
+    Delete the templates with a bounded number of deletions in flight at the same time.
+    With a time budget, the largest templates are deleted first, so the most space is freed before the deadline.
+    :param api: The vCenter API instance
+    :param templates: The templates to delete, grouped by name
+    :param concurrency: The maximum number of deletions running at the same time
+    :param ordered: The flag to delete the templates of a group strictly one after another, in list order
+    :param dry_run: The flag to skip sending the deletion requests
+    :param deadline: The optional time budget; deletions which would not finish in time are skipped
+    :param journal: The optional journal to record the completed deletions in
+    :return: The results of all deletions
+    """
+    concurrency = max(1, concurrency)
+    results = []
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='delete') as executor:
+        if ordered:
+            # One task per group: groups run in parallel, items within a group keep their order
+            groups = list(templates)
+            if deadline is not None:
+                groups.sort(key=lambda g: sum(template.size or 0 for template in templates[g]), reverse=True)
+            futures = [executor.submit(delete_group, api, group, templates[group], dry_run, deadline, journal)
+                       for group in groups]
+            for future in futures:
+                results.extend(future.result())
+        else:
+            # One task per item
+            items = []
+            for group in templates:
+                log(sev='info', msg=' Cleaning up template "{}"...', args=(group,))
+                items.extend((group, template) for template in templates[group])
+            if deadline is not None:
+                items.sort(key=lambda item: item[1].size or 0, reverse=True)
+            futures = [executor.submit(delete_template, api, group, template, dry_run, deadline, journal)
+                       for group, template in items]
+            results = [future.result() for future in futures]
+
+    return results
+
+
+def print_summary(results: list[DeletionResult], dry_run: bool = False) -> None:
+    """
+    Helper function to print a summary table of the deletion results per template group.
+    :param results: The results of the deletions
+    :param dry_run: The flag to mark the freed bytes as projected
+    """
+    # Aggregate per group: [deleted, failed, bytes freed]
+    summary = {}
+    skipped = 0
+    for result in results:
+        if result.group not in summary:
+            summary[result.group] = [0, 0, 0]
+        if result.skipped:
+            skipped += 1
+        elif result.success:
+            summary[result.group][0] += 1
+            summary[result.group][2] += result.template.size or 0
+        else:
+            summary[result.group][1] += 1
+
+    width = max([len(group) for group in summary] + [len('Template'), len('Total')])
+    row = ' {:<' + str(width) + 's} | {:>7} | {:>6} | {:>12}'
+    log(sev='info', msg='Deletion summary{}:', args=(' (dry-run, projected)' if dry_run else '',))
+    log(sev='info', msg=row.format('Template', 'Deleted', 'Failed', 'Freed'))
+    for group in summary:
+        deleted, failed, freed = summary[group]
+        log(sev='info', msg=row.format(group, deleted, failed, format_size(freed)))
+    log(sev='info', msg=row.format('Total', sum(s[0] for s in summary.values()), sum(s[1] for s in summary.values()),
+                                   format_size(sum(s[2] for s in summary.values()))))
+    if skipped:
+        log(sev='warn', msg='{} deletions were skipped, the time budget is exhausted.', args=(skipped,))
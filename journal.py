@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+import time
+from dataclasses import fields
+from typing import Optional, TextIO
+
+from api_vcenter import CLTemplate
+from logger import log
+from metadata_cache import MetadataCache
+
+# Version of the journal format. Journals of another version are discarded.
+JOURNAL_VERSION = 1
+
+
+# Journal Class
+class Journal(MetadataCache):
+    """
+    Append-only checkpoint journal of a run, as JSON lines: every fetched template, every item found to be no
+    vm-template and every completed deletion is appended as soon as it is known. An interrupted run resumes from the
+    journal instead of fetching all metadata again. The journal is removed once a run completed.
+    Acts as metadata cache, optionally backed by a regular cache file as well.
+    """
+
+    def __init__(self, path: str, cache_path: str = ''):
+        """
+        Class initialization. The journal is empty until load() is called.
+        :param path: The path of the journal file
+        :param cache_path: The optional path of the metadata cache file, loaded and saved as usual
+        """
+        super().__init__(path=cache_path)
+        self.journal_path = path
+        self.write_lock = threading.Lock()
+        self.file: Optional[TextIO] = None
+        self.deletions: set[str] = set()
+
+    def _append(self, record: dict) -> None:
+        """
+        Helper function to append a record to the journal. The line is flushed right away, so it survives the
+        process being killed.
+        :param record: The record to append
+        :return: None
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.write_lock:
+            if self.file is not None:
+                self.file.write(line)
+                self.file.flush()
+
+    # Persistence
+    def load(self) -> None:
+        """
+        Load the metadata cache file, if any, and replay the journal of an interrupted run. A partially written last
+        line is cut off, so the records appended afterward start on a line of their own. Afterward the journal is open
+        for appending.
+        :return: None
+        """
+        if self.path:
+            super().load()
+
+        templates = skipped = 0
+        # Offset of the end of the last complete record, and of the end of the file
+        end = size = 0
+        try:
+            with open(self.journal_path, 'rb') as f:
+                header = json.loads(f.readline() or '{}')
+                end = f.tell()
+                if header.get('version') != JOURNAL_VERSION:
+                    log(sev='warn', msg='Journal {} has an unsupported version, starting a new journal.',
+                        args=(self.journal_path,))
+                else:
+                    for line in iter(f.readline, b''):
+                        try:
+                            if not line.endswith(b'\n'):
+                                raise ValueError('incomplete line')
+                            record = json.loads(line)
+                            if record['type'] == 'template':
+                                template = CLTemplate(*record['item'])
+                                super().put(library_id=record['library'], template=template)
+                                templates += 1
+                            elif record['type'] == 'skip':
+                                super().skip(library_id=record['library'], item_id=record['id'])
+                                skipped += 1
+                            elif record['type'] == 'deleted':
+                                self.deletions.add(record['id'])
+                        except (ValueError, KeyError, TypeError):
+                            # The run was killed while writing this line
+                            break
+                        end = f.tell()
+                    size = f.seek(0, os.SEEK_END)
+                    log(sev='info', msg='Resuming from journal {}: {} templates, {} other items and {} deletions '
+                                        'recorded.', args=(self.journal_path, templates, skipped, len(self.deletions)))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log(sev='warn', msg='Could not read journal {}: {}. Starting a new journal.', args=(self.journal_path, e))
+
+        if templates or skipped or self.deletions:
+            if size > end:
+                log(sev='warn', msg='Journal {} ends with an incomplete record, dropping its last {} bytes.',
+                    args=(self.journal_path, size - end))
+                os.truncate(self.journal_path, end)
+            self.file = open(self.journal_path, 'a')
+        else:
+            self.file = open(self.journal_path, 'w')
+            self._append({'version': JOURNAL_VERSION, 'started': time.time()})
+
+    def save(self) -> None:
+        """
+        Write the metadata cache file, if any. The journal itself is always up to date.
+        :return: None
+        """
+        if self.path:
+            super().save()
+
+    def close(self, completed: bool = False) -> None:
+        """
+        Close the journal. A completed run removes the journal, an incomplete run keeps it for the next run to resume.
+        :param completed: The flag whether the run completed
+        :return: None
+        """
+        with self.write_lock:
+            if self.file is None:
+                return
+            self.file.close()
+            self.file = None
+        if completed:
+            os.remove(self.journal_path)
+            log(sev='debug', msg='Run completed, removed journal {}.', args=(self.journal_path,))
+        else:
+            log(sev='info', msg='Run incomplete, keeping journal {} to resume from.', args=(self.journal_path,))
+
+    # Journal access
+    def put(self, library_id: str, template: CLTemplate) -> None:
+        """
+        Store a template in the cache and record it in the journal.
+        :param library_id: The ID of the Content Library
+        :param template: The template to store
+        :return: None
+        """
+        super().put(library_id=library_id, template=template)
+        self._append({'type': 'template', 'library': library_id,
+                      'item': [getattr(template, f.name) for f in fields(CLTemplate)]})
+
+    def skip(self, library_id: str, item_id: str) -> None:
+        """
+        Remember an item which is no vm-template, and record it in the journal.
+        :param library_id: The ID of the Content Library
+        :param item_id: The ID of the Content Library item
+        :return: None
+        """
+        super().skip(library_id=library_id, item_id=item_id)
+        self._append({'type': 'skip', 'library': library_id, 'id': item_id})
+
+    def deleted(self, library_id: str, item_id: str) -> None:
+        """
+        Record a completed deletion in the journal.
+        :param library_id: The ID of the Content Library
+        :param item_id: The ID of the deleted Content Library item
+        :return: None
+        """
+        with self.lock:
+            self.deletions.add(item_id)
+        self._append({'type': 'deleted', 'library': library_id, 'id': item_id})
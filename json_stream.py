@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+import codecs
+import json
+from typing import Any, Iterable, Iterator
+
+# Characters skipped between the values of an array
+WHITESPACE = ' \t\n\r'
+
+
+def iter_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Incrementally decode a JSON array from a stream of byte chunks, yielding each value as soon as it is complete.
+    Only the current value and the unparsed rest of the last chunk are held in memory, not the whole document.
+    :param chunks: The UTF-8 encoded document in chunks of any size, e.g. from a streamed HTTP response
+    :return: Iterator over the values of the array
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    pos = 0
+    # Expecting: '[' to open the array, a value, ',' or ']' after a value, or nothing after the array
+    state = 'open'
+    chunks = iter(chunks)
+    done = False
+
+    while True:
+        # Skip whitespace, then read more data if the buffer is exhausted
+        while pos < len(buffer) and buffer[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buffer) or (state in ('first', 'value') and not done and _incomplete(buffer, pos)):
+            if done:
+                break
+            chunk = next(chunks, None)
+            if chunk is None:
+                done = True
+                buffer = buffer[pos:] + utf8.decode(b'', final=True)
+            else:
+                buffer = buffer[pos:] + utf8.decode(chunk)
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if state == 'open':
+            if char != '[':
+                raise ValueError('Expected a JSON array, got {!r}'.format(buffer[pos:pos + 20]))
+            pos += 1
+            state = 'first'
+        elif state == 'first' and char == ']':
+            pos += 1
+            state = 'end'
+        elif state in ('first', 'value'):
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if done:
+                    raise
+                # The value continues in the next chunk
+                chunk = next(chunks, None)
+                done = chunk is None
+                buffer = buffer[pos:] + utf8.decode(chunk or b'', final=done)
+                pos = 0
+                continue
+            pos = end
+            state = 'next'
+            yield value
+        elif state == 'next':
+            if char == ',':
+                state = 'value'
+            elif char == ']':
+                state = 'end'
+            else:
+                raise ValueError('Expected , or ] in JSON array, got {!r}'.format(buffer[pos:pos + 20]))
+            pos += 1
+        else:
+            raise ValueError('Unexpected data after JSON array: {!r}'.format(buffer[pos:pos + 20]))
+
+    if state != 'end':
+        raise ValueError('Incomplete JSON array')
+
+
+def _incomplete(buffer: str, pos: int) -> bool:
+    """
+    Helper function to check if a number or literal at the end of the buffer may continue in the next chunk. Strings,
+    objects and arrays are closed by a delimiter, so the decoder fails on them while they are incomplete.
+    :param buffer: The decoded text
+    :param pos: The start of the value
+    :return: True if the value reaches up to the end of the buffer and may not be complete yet
+    """
+    if buffer[pos] in '"{[':
+        return False
+    for i in range(pos, len(buffer)):
+        if buffer[i] in ',]' or buffer[i] in WHITESPACE:
+            return False
+    return True
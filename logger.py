@@ -1,23 +1,124 @@
 #!/usr/bin/env python3
+import atexit
+import json
+import queue
+import sys
+import threading
+import time
 from datetime import datetime
 from os import environ
 
 # Constants
 debug = environ.get('CLEANUP_SCRIPT_DEBUG', 'false').lower() == 'true'
+log_format = environ.get('CLEANUP_SCRIPT_LOG_FORMAT', 'text').lower()
+
+# Severity levels; messages below the configured level are dropped before they are formatted
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'WARNING': 30, 'ERROR': 40}
+level = LEVELS.get(environ.get('CLEANUP_SCRIPT_LOG_LEVEL', 'debug' if debug else 'info').upper(), LEVELS['INFO'])
+
+# Output sink: a queue drained by a background writer thread, which writes the lines in batches
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+# Formatted timestamp of the current second, the timestamp only changes once per second
+_timestamp = (0, '')
+
+
+def enabled(sev: str) -> bool:
+    """
+    Check if messages of a severity level are emitted. Useful to skip building expensive debug output.
+    :param sev: The severity level (debug, info, warning, error)
+    :return: True if messages of this severity are emitted
+    """
+    return LEVELS.get(sev.upper(), LEVELS['INFO']) >= level
+
+
+def _now() -> str:
+    """
+    Helper function to get the formatted local time, cached per second.
+    :return: The formatted timestamp
+    """
+    global _timestamp
+    second = int(time.time())
+    if _timestamp[0] != second:
+        _timestamp = (second, datetime.fromtimestamp(second).astimezone().strftime('%Y-%m-%dT%H:%M:%S%z'))
+    return _timestamp[1]
+
+
+def _write() -> None:
+    """
+    Writer thread: writes all queued lines to stdout in batches.
+    """
+    while True:
+        lines = [_queue.get()]
+        while True:
+            try:
+                lines.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        sys.stdout.write(''.join(lines))
+        sys.stdout.flush()
+        for _ in lines:
+            _queue.task_done()
+
+
+def flush() -> None:
+    """
+    Wait until all queued messages are written.
+    """
+    if _writer is not None:
+        _queue.join()
+
+
+def _emit(line: str) -> None:
+    """
+    Helper function to queue a line for the writer thread, starting the thread on first use.
+    :param line: The line to write, including the line break
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write, name='logger', daemon=True)
+                _writer.start()
+                atexit.register(flush)
+    _queue.put(line)
 
 
 # Basic logging function
-def log(sev: str, msg: str) -> None:
+def log(sev: str, msg: str, args: tuple = ()) -> None:
     """
     Basic logging function. Prints a message with a timestamp and severity level.
-    :param sev: The severity level of the message (info, warning, error)
-    :param msg: The message to print
+    The message is only formatted with its arguments if it is actually emitted.
+    :param sev: The severity level of the message (debug, info, warning, error)
+    :param msg: The message to print, optionally with str.format placeholders
+    :param args: The arguments for the placeholders in the message
     """
     severity = sev.upper()
-    if not debug and severity == 'DEBUG':
+    if LEVELS.get(severity, LEVELS['INFO']) < level:
         return
-    date = datetime.now().astimezone().strftime('%Y-%m-%dT%H:%M:%S%z')
-    print('[{0}] [{1: <5s}] {2}'.format(date, severity, msg))
+    if args:
+        msg = msg.format(*args)
+
+    if log_format == 'json':
+        _emit(json.dumps({'time': _now(), 'level': sev.lower(), 'thread': threading.current_thread().name,
+                          'msg': msg}) + '\n')
+    else:
+        _emit('[{0}] [{1: <5s}] {2}\n'.format(_now(), severity, msg))
 
     if severity == 'ERROR':
+        flush()
         raise Exception(msg)
+
+
+def log_exception(msg: str, args: tuple = ()) -> None:
+    """
+    Log an exception caught to carry on, as warning with its traceback at debug level. Errors logged already are
+    repeated, but failures not raised by log(), e.g. network errors or bugs, would get lost otherwise.
+    :param msg: The message to print, usually with the exception as one of its arguments
+    :param args: The arguments for the placeholders in the message
+    """
+    log(sev='warn', msg=msg, args=args)
+    if enabled('debug'):
+        import traceback
+        log(sev='debug', msg=traceback.format_exc().rstrip())
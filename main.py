@@ -1,118 +1,408 @@
 #!/usr/bin/env python3
-import traceback
-from os import environ
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable, Iterator, Optional, Union
 
 import api_vcenter
 import cldata
-from logger import log, debug
+import deletion
+import plan
+from config import MODES, Config
+from journal import Journal
+from logger import log, log_exception, enabled
+from metadata_cache import MetadataCache
+from metrics import metrics
+from rate_limit import SharedRateLimiter
+from session_cache import SessionCache
+from targets import Target, TargetResult, load_targets, print_report
 
 # Version
 VERSION = [1, 2, 0]
 
 # Settings
-# vCenter API
-api_host = environ.get('PKR_VAR_vsphere_endpoint')
-api_user = environ.get('PKR_VAR_vsphere_username')
-api_pass = environ.get('PKR_VAR_vsphere_password')
+config = Config.from_env()
+session_cache = SessionCache(path=config.session_cache_path, ttl=config.session_cache_ttl) \
+    if config.session_cache_path else None
+deadline = deletion.Deadline(at=time.monotonic() + config.time_budget) if config.time_budget > 0 else None
+# Set up at startup if enabled, see CLEANUP_SCRIPT_RATE_LIMIT and CLEANUP_SCRIPT_CASSETTE
+rate_limiter = None
+cassette = None
 
-# Generic settings from packer env
-content_library = environ.get('PKR_VAR_vsphere_content_library')
-insecure_api = environ.get('PKR_VAR_vsphere_insecure_connection', 'true').lower() == 'true'
 
-# Cleanup-specific settings
-dry_run = environ.get('CLEANUP_SCRIPT_DRY_RUN', 'false').lower() == 'true'
-templates_to_keep = int(environ.get('CLEANUP_SCRIPT_TEMPLATES_TO_KEEP', 1))
-if templates_to_keep < 1:
-    templates_to_keep = 1
+def export_metrics(targets: list[Target], results: list[TargetResult]) -> None:
+    """
+    Export the metrics of the run to the configured files.
+    :param targets: The targets of the run
+    :param results: The results of the targets
+    :return: None
+    """
+    libraries = ','.join(target.library for target in targets)
+    if config.metrics_json_path:
+        metrics.write_json(path=config.metrics_json_path, extra={'version': '.'.join(map(str, VERSION)),
+                                                          'content_library': libraries,
+                                                          'targets': [{'endpoint': r.endpoint,
+                                                                       'library': r.library,
+                                                                       'success': r.success} for r in results]})
+    if config.metrics_prometheus_path:
+        metrics.write_prometheus(path=config.metrics_prometheus_path, labels={'content_library': libraries})
+
+
+def checkpoint(targets: list[Target], cache: Optional[MetadataCache]) -> None:
+    """
+    Save the metadata cache and export the metrics, after each poll in daemon mode.
+    :param targets: The watched targets
+    :param cache: The optional metadata cache
+    :return: None
+    """
+    if cache is not None:
+        cache.save()
+    export_metrics(targets=targets, results=[])
+
+
+def shut_down(action: Callable[[], object], what: str) -> None:
+    """
+    Helper function to run a step of the shutdown, logging a warning instead of raising if it fails.
+    :param action: The step to run
+    :param what: The description of the step for the warning
+    :return: None
+    """
+    try:
+        action()
+    except Exception as e:
+        log(sev='warn', msg='Failed to {}: {}', args=(what, e))
 
-# Main code
-if '__main__' == __name__:
-    log(sev='info', msg='Starting vmw-cls-cleanup {}...'.format('.'.join(map(str, VERSION))))
 
-    # Create an instance of the vCenter API
-    api = api_vcenter.create(api_host=api_host, api_user=api_user, api_pass=api_pass)
+def connect(target: Target, streams: int = 1) -> api_vcenter.VCAPI:
+    """
+    Create an instance of the vCenter API for the endpoint of a target and login.
+    :param target: The target whose endpoint and credentials are used
+    :param streams: The number of Content Libraries of the endpoint processed at the same time
+    :return: The logged in vCenter API instance
+    """
+    threading.current_thread().name = target.endpoint
+    api = api_vcenter.create(api_host=target.endpoint, api_user=target.username, api_pass=target.password,
+                             pool_size=config.pool_size, retries=config.retries, backoff=config.retry_backoff,
+                             rate_limiter=rate_limiter, cassette=cassette,
+                             timeout=(config.connect_timeout, config.request_timeout), streams=streams)
     if api is None:
-        log(sev='error', msg='Failed to create an instance of the vCenter API. Exiting...')
-        exit(1)
+        log(sev='error', msg='Failed to create an instance of the vCenter API for {}.', args=(target.endpoint,))
 
     # Allow insecure SSL connections
-    api.allow_insecure_ssl(insecure=insecure_api)
+    api.allow_insecure_ssl(insecure=target.insecure)
+
+    # Login to vCenter, unless a cached session is still valid
+    with metrics.phase('login'):
+        session_id = session_cache.get(endpoint=target.endpoint, username=target.username) if session_cache else None
+        if session_id is not None and api.resume(session_id=session_id):
+            return api
+        if session_id is not None:
+            session_cache.evict(endpoint=target.endpoint, username=target.username)
+        login = api.login()
+    # Check if the login was successful
+    if not login:
+        log(sev='error', msg='Failed to login to vCenter {}.', args=(target.endpoint,))
+    return api
 
-    # By default, continue with cleanup
-    cleanup = True
 
+def try_connect(target: Target, streams: int = 1) -> Optional[api_vcenter.VCAPI]:
+    """
+    Helper function to connect to the endpoint of a target, returning None if it fails.
+    :param target: The target whose endpoint and credentials are used
+    :param streams: The number of Content Libraries of the endpoint processed at the same time
+    :return: The logged in vCenter API instance, or None
+    """
     try:
-        # Login to vCenter
-        login = api.login()
-        # Check if the login was successful
-        if not login:
-            log(sev='error', msg='Failed to login to vCenter. Exiting...')
-            exit(1)
-
-        # Get all templates
-        templates = api.get_cls_templates(library=content_library)
-        if templates is None:
-            log(sev='error', msg='Error occurred while retrieving Content Library templates.')
-            cleanup = False
-        if len(templates) == 0:
-            log(sev='warn', msg='No templates found in the Content Library. Ending...')
-            cleanup = False
-
-        # Continue with cleanup
-        if cleanup:
-
-            # Use templates_data to convert the templates further
-            templates = cldata.convert(templates=templates)
-            # Output all templates if debug is enabled
-            if debug:
-                log(sev='debug', msg='Final data of all existing templates:')
-                cldata.print_list(templates=templates)
-
-            # Check for the templates to delete
-            templates = cldata.templates_to_delete(templates=templates, keep=templates_to_keep)
-            # Output the templates to be deleted, if debug is enabled
-            if debug:
-                log(sev='debug', msg='Final data for templates to be deleted:')
-                cldata.print_list(templates=templates)
-
-            # Delete the templates
-            log(sev='info', msg='Deleting templates...')
-            if dry_run:
-                log(sev='warn', msg='/!\\ Dry-run enabled, not sending deletion API requests! /!\\')
-
-            # Check if there are any templates to delete
-            if len(templates) == 0:
-                log(sev='warn', msg='No templates to delete.')
-            else:
-                # Go through each template type and delete the templates
-                for template in templates:
-                    log(sev='info', msg=' Cleaning up template "{}"...'.format(template))
-                    # Go through each item per template type and delete it
-                    for item in templates[template]:
-                        log(sev='info', msg='  Deleting template "{}" with ID {}...'.format(item.name, item.id))
-                        # Skip deletion if dry-run is enabled
-                        if dry_run:
-                            continue
-                        # Delete the template item
-                        deletion, deletion_error = api.delete_library_item(item_id=item.id)
-                        # deletion, deletion_error = True, None
-                        # Check if the deletion was successful
-                        if deletion:
-                            log(sev='info', msg='   Successfully deleted template {}.'.format(item.id))
-                        else:
-                            log(sev='warn', msg='   Error occurred while deleting template {}: {}.'
-                                .format(item.id, deletion_error))
+        return connect(target=target, streams=streams)
+    except Exception as e:
+        log_exception(msg='Not connected to vCenter {}: {}', args=(target.endpoint, e))
+        return None
+
+
+def delete(api: api_vcenter.VCAPI, templates: dict,
+           journal: Optional[Journal] = None) -> list[deletion.DeletionResult]:
+    """
+    Delete the given templates.
+    :param api: The vCenter API instance
+    :param templates: The templates to delete, grouped by name
+    :param journal: The optional journal; templates recorded as deleted already are left out
+    :return: The results of the deletions
+    """
+    if journal is not None:
+        templates = {name: [template for template in templates[name] if template.id not in journal.deletions]
+                     for name in templates}
+    log(sev='info', msg='Deleting templates...')
+    if config.dry_run:
+        log(sev='warn', msg='/!\\ Dry-run enabled, not sending deletion API requests! /!\\')
+
+    # Check if there are any templates to delete
+    if sum(len(templates[template]) for template in templates) == 0:
+        log(sev='warn', msg='No templates to delete.')
+        return []
+
+    # Go through each template type and delete the templates; dry-run takes the same path
+    with metrics.phase('delete'):
+        return deletion.delete_templates(api=api, templates=templates, concurrency=config.delete_concurrency,
+                                         ordered=config.delete_ordered, dry_run=config.dry_run, deadline=deadline,
+                                         journal=journal)
+
+
+def count(templates: Iterable[api_vcenter.CLTemplate], result: TargetResult) -> Iterator[api_vcenter.CLTemplate]:
+    """
+    Helper function to count the templates of a stream in the result of the target, while passing them on.
+    :param templates: The stream of templates
+    :param result: The result of the target to count the templates in
+    :return: Iterator over the templates
+    """
+    for template in templates:
+        result.templates += 1
+        yield template
+
+
+def clean_up(api: api_vcenter.VCAPI, target: Target, cache: Optional[MetadataCache],
+             result: TargetResult) -> None:
+    """
+    Determine the templates to delete in the Content Library of a target, and delete them or plan their deletion.
+    :param api: The logged in vCenter API instance of the endpoint of the target
+    :param target: The target
+    :param cache: The optional metadata cache
+    :param result: The result of the target to fill in
+    :return: None
+    """
+    # Stream all templates into the grouping by name, and check for the templates to delete
+    templates = count(templates=api.iter_cls_templates(library=target.library, concurrency=config.fetch_concurrency,
+                                                       server_filter=config.server_filter, cache=cache),
+                      result=result)
+    if target.budget is not None:
+        templates = cldata.templates_over_budget(templates=templates, budget=target.budget, keep=target.keep,
+                                                 pattern=config.name_pattern, scope=config.storage_budget_scope)
+    else:
+        templates = cldata.templates_to_delete(templates=templates, keep=target.keep, pattern=config.name_pattern)
+    if result.templates == 0:
+        log(sev='warn', msg='No templates found in the Content Library {}.', args=(target.label,))
+        if config.mode == 'plan':
+            # Plan the library anyway, with nothing to delete
+            result.plan = plan.build_target(endpoint=target.endpoint, library=target.library,
+                                            library_id=api.library_ids[target.library], keep=target.keep,
+                                            templates={})
+        return
+    result.planned = sum(len(templates[name]) for name in templates)
+    # Output the templates to be deleted, if debug is enabled
+    if enabled('debug'):
+        log(sev='debug', msg='Final data for templates to be deleted:')
+        cldata.print_list(templates=templates)
+
+    if config.mode == 'plan':
+        # Only plan the deletion, it is executed later in apply mode
+        result.plan = plan.build_target(endpoint=target.endpoint, library=target.library,
+                                        library_id=api.library_ids[target.library], keep=target.keep,
+                                        templates=templates)
+    else:
+        # Delete the templates
+        result.results = delete(api=api, templates=templates, journal=cache if isinstance(cache, Journal) else None)
+
+
+def apply_plan(api: api_vcenter.VCAPI, target: dict, result: TargetResult) -> None:
+    """
+    Delete the templates of the deletion plan of a Content Library. Instead of fetching metadata again, only the
+    listing of the Content Library is retrieved once to skip planned items which no longer exist.
+    :param api: The logged in vCenter API instance of the endpoint of the plan
+    :param target: The deletion plan of the Content Library
+    :param result: The result of the target to fill in
+    :return: None
+    """
+    templates = plan.target_templates(target=target)
+    with metrics.phase('listing'):
+        existing = api.get_library_items(library_id=target['library_id'])
+    if existing is None:
+        log(sev='error', msg='Error occurred while retrieving Content Library items.')
+
+    existing = set(existing)
+    gone = 0
+    for name in templates:
+        planned = len(templates[name])
+        templates[name] = [template for template in templates[name] if template.id in existing]
+        gone += planned - len(templates[name])
+    result.planned = sum(len(templates[name]) for name in templates)
+    log(sev='info', msg='Applying plan of Content Library "{}": {} templates to delete, {} already gone.',
+        args=(target['library'], result.planned, gone))
+    result.results = delete(api=api, templates=templates)
+
+
+def process(target: Union[Target, dict], sessions: dict[str, Optional[api_vcenter.VCAPI]],
+            cache: Optional[MetadataCache]) -> TargetResult:
+    """
+    Process a single target, catching all errors so the other targets are not affected.
+    :param target: The target, or the deletion plan of a Content Library in apply mode
+    :param sessions: The logged in vCenter API instances by endpoint, None if the login failed
+    :param cache: The optional metadata cache
+    :return: The result of the target
+    """
+    endpoint, library = (target['endpoint'], target['library']) if isinstance(target, dict) \
+        else (target.endpoint, target.library)
+    threading.current_thread().name = '{}/{}'.format(endpoint, library)
+    result = TargetResult(endpoint=endpoint, library=library)
+    api = sessions[endpoint]
+    if api is None:
+        result.error = 'Not logged in to vCenter {}.'.format(endpoint)
+        return result
+    try:
+        if isinstance(target, dict):
+            apply_plan(api=api, target=target, result=result)
+        else:
+            clean_up(api=api, target=target, cache=cache, result=result)
+        failed = sum(not r.success and not r.skipped for r in result.results)
+        result.success = failed == 0
+        if not result.success:
+            result.error = 'Failed to delete {} templates.'.format(failed)
+    except Exception as e:
+        log_exception(msg='Failed to clean up {}/{}: {}', args=(endpoint, library, e))
+        result.error = str(e)
+    return result
+
+
+# Main code
+if '__main__' == __name__:
+    log(sev='info', msg='Starting vmw-cls-cleanup {}...', args=('.'.join(map(str, VERSION)),))
+    if config.mode not in MODES:
+        log(sev='error', msg='Unknown mode {}, must be one of {}. Exiting...', args=(config.mode, ', '.join(MODES)))
+    if config.missing():
+        log(sev='error', msg='Missing required environment variables: {}. Exiting...',
+            args=(', '.join(config.missing()),))
+    if config.profile_dir:
+        # Imported on demand, like all modules only needed by optional features
+        from profiler import Profiler
+        metrics.profiler = Profiler(directory=config.profile_dir, frames=config.profile_frames)
+    if config.cassette_path:
+        from cassette import Cassette
+        cassette = Cassette(path=config.cassette_path, mode=config.cassette_mode, latency=config.cassette_latency)
+
+    # The Content Libraries to clean up
+    targets = load_targets(config=config.targets_config, default=config.default_target)
+    if config.mode == 'daemon' and any(target.budget is not None for target in targets):
+        # The daemon only keeps a number of templates per name, it would delete templates a budget keeps
+        log(sev='error', msg='Storage budgets are not supported in daemon mode, unset the budget of {}. Exiting...',
+            args=(', '.join(target.label for target in targets if target.budget is not None),))
+    # One session per endpoint, shared by all Content Libraries on that endpoint
+    endpoints = {}
+    for target in targets:
+        endpoints.setdefault(target.endpoint, target)
+    log(sev='info', msg='Cleaning up {} Content Libraries on {} vCenter endpoints.',
+        args=(len(targets), len(endpoints)))
+
+    sessions = {}
+    results = []
+    if session_cache is not None:
+        session_cache.load()
+    try:
+        if config.rate_limit > 0:
+            rate_limiter = SharedRateLimiter(path=config.rate_limit_file, rate=config.rate_limit,
+                                             burst=config.rate_limit_burst)
+        with ThreadPoolExecutor(max_workers=config.target_concurrency) as executor:
+            # Every Content Library processed at the same time streams its listing over a connection of its own
+            streams = [min(config.target_concurrency, sum(target.endpoint == endpoint for target in targets))
+                       for endpoint in endpoints]
+            sessions = dict(zip(endpoints, executor.map(try_connect, endpoints.values(), streams)))
+
+            # Load the metadata cache, if enabled; library IDs are unique, so all targets share one cache.
+            # The journal of an interrupted run acts as metadata cache as well.
+            cache = None
+            if config.mode in ('run', 'plan') and config.journal_path:
+                cache = Journal(path=config.journal_path, cache_path=config.metadata_cache_path)
+                cache.load()
+            elif config.mode != 'apply' and config.metadata_cache_path:
+                cache = MetadataCache(path=config.metadata_cache_path)
+                cache.load()
+
+            # In apply mode, the targets are the planned Content Libraries on the configured endpoints
+            work = targets if config.mode != 'daemon' else []
+            if config.mode == 'apply':
+                work = plan.read_plan(path=config.plan_file)
+                if work is None:
+                    log(sev='error', msg='Failed to read the deletion plan {}.', args=(config.plan_file,))
+                for target in [target for target in work if target['endpoint'] not in sessions]:
+                    log(sev='warn', msg='Skipping plan of Content Library "{}", vCenter {} is not configured.',
+                        args=(target['library'], target['endpoint']))
+                work = [target for target in work if target['endpoint'] in sessions]
+
+            results = list(executor.map(partial(process, sessions=sessions, cache=cache), work))
+
+        if config.mode == 'daemon':
+            from daemon import Daemon, WatchedLibrary
+            # Watch the Content Libraries until stopped; without a cache file, the metadata cache lives in memory only
+            for target in [target for target in targets if sessions[target.endpoint] is None]:
+                log(sev='warn', msg='Not watching {}, not logged in to vCenter.', args=(target.label,))
+            watcher = Daemon(libraries=[WatchedLibrary(api=sessions[target.endpoint], target=target,
+                                                       pattern=config.name_pattern)
+                                        for target in targets if sessions[target.endpoint] is not None],
+                             cache=cache or MetadataCache(path=''), interval=config.poll_interval,
+                             fetch_concurrency=config.fetch_concurrency, delete_concurrency=config.delete_concurrency,
+                             delete_ordered=config.delete_ordered, dry_run=config.dry_run,
+                             after_poll=partial(checkpoint, targets=targets, cache=cache))
+            if config.trigger_port:
+                watcher.serve_trigger(port=config.trigger_port)
+            watcher.run()
+
+        if cache is not None:
+            cache.save()
+        if isinstance(cache, Journal):
+            # Keep the journal if a target failed or deletions were skipped, so the next run resumes
+            cache.close(completed=all(result.success and not any(r.skipped for r in result.results)
+                                      for result in results))
+        if config.mode == 'plan':
+            # Only write the deletion plan, it is executed later in apply mode
+            plan.write_plan(path=config.plan_file, targets=[result.plan for result in results
+                                                       if result.success and result.plan is not None],
+                            version='.'.join(map(str, VERSION)))
+
+        # Print the deletion summaries and the consolidated report
+        for result in results:
+            if result.results:
+                log(sev='info', msg='Content Library {}/{}:', args=(result.endpoint, result.library))
+                deletion.print_summary(results=result.results, dry_run=config.dry_run)
+        if results:
+            print_report(results=results, dry_run=config.dry_run)
 
         # We're done! Templates cleaned up.
         log(sev='info', msg='Finished cleaning up templates.')
 
     except Exception as e:
         # Catch any exceptions and logout of VC
-        log(sev='error', msg='Error occurred: {}'.format(e))
+        log(sev='error', msg='Error occurred: {}', args=(e,))
+        import traceback
         print(traceback.format_exc())
         exit(1)
     finally:
-        api.logout()
+        # Each step may fail on its own, without skipping the remaining sessions or the export of the metrics
+        with metrics.phase('logout'):
+            for endpoint, api in sessions.items():
+                if api is None:
+                    continue
+                if session_cache is not None:
+                    # Keep the session open for the next run
+                    log(sev='info', msg='Keeping vCenter session open for the next run.')
+                    session_cache.put(endpoint=endpoint, username=api.username, token=api.session_id)
+                else:
+                    shut_down(action=api.logout, what='log out from vCenter {}'.format(endpoint))
+                shut_down(action=api.close, what='close the connections to vCenter {}'.format(endpoint))
+            if session_cache is not None:
+                shut_down(action=session_cache.save, what='save the session cache')
+        if cassette is not None:
+            shut_down(action=cassette.close, what='close the cassette')
+        if rate_limiter is not None:
+            shut_down(action=rate_limiter.close, what='close the rate limit file')
 
+        # Export the metrics of the run
+        metrics.log_summary()
+        export_metrics(targets=targets, results=results)
+        if metrics.profiler is not None:
+            metrics.profiler.write()
+
+    # Only fail if a target failed, all other targets are cleaned up anyway
+    failed = sum(not result.success for result in results)
+    if failed:
+        log(sev='warn', msg='Done, {} of {} targets failed.', args=(failed, len(results)))
+        exit(1)
     log(sev='info', msg='Done.')
     exit(0)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+from dataclasses import fields
+from typing import Optional
+
+from api_vcenter import CLTemplate
+from logger import log
+
+# Version of the cache file format. Caches of another version are discarded.
+CACHE_VERSION = 2
+
+
+# Metadata Cache Class
+class MetadataCache:
+    """Persistent on-disk cache of Content Library item metadata, keyed by library ID and item ID."""
+
+    def __init__(self, path: str):
+        """
+        Class initialization. The cache is empty until load() is called.
+        :param path: The path of the JSON cache file
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.libraries = {}
+        self.changed = False
+
+    # Helper functions
+    @staticmethod
+    def _serialize(template: CLTemplate) -> list:
+        """
+        Helper function to turn a CLTemplate object into a compact JSON-serializable list.
+        :param template: The template to serialize
+        :return: The field values of the template, in field order
+        """
+        return [getattr(template, f.name) for f in fields(CLTemplate)]
+
+    @staticmethod
+    def _deserialize(data: list) -> CLTemplate:
+        """
+        Helper function to turn a serialized template back into a CLTemplate object.
+        :param data: The field values of the template, in field order
+        :return: The CLTemplate object
+        """
+        return CLTemplate(*data)
+
+    def _library(self, library_id: str) -> dict:
+        """
+        Get the cache entries of a library, creating them if necessary. Must be called with the lock held.
+        :param library_id: The ID of the Content Library
+        :return: The cache entries of the library
+        """
+        if library_id not in self.libraries:
+            self.libraries[library_id] = {'templates': {}, 'skipped': set()}
+        return self.libraries[library_id]
+
+    # Persistence
+    def load(self) -> None:
+        """
+        Load the cache from disk. A missing, unreadable or outdated cache file results in an empty cache.
+        :return: None
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            log(sev='info', msg='Metadata cache {} does not exist yet, starting with an empty cache.',
+                args=(self.path,))
+            return
+        except (OSError, ValueError) as e:
+            log(sev='warn', msg='Could not read metadata cache {}: {}. Starting with an empty cache.',
+                args=(self.path, e))
+            return
+
+        if data.get('version') != CACHE_VERSION:
+            log(sev='warn', msg='Metadata cache {} has an unsupported version, starting with an empty cache.',
+                args=(self.path,))
+            return
+
+        for library_id, entries in data.get('libraries', {}).items():
+            self.libraries[library_id] = {
+                'templates': {item_id: self._deserialize(item) for item_id, item in entries['templates'].items()},
+                'skipped': set(entries['skipped']),
+            }
+        log(sev='info', msg='Loaded metadata cache {} with {} items.',
+            args=(self.path, sum(len(entries['templates']) for entries in self.libraries.values())))
+
+    def save(self) -> None:
+        """
+        Write the cache to disk, if it changed. The file is replaced atomically.
+        :return: None
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            data = {
+                'version': CACHE_VERSION,
+                'libraries': {
+                    library_id: {
+                        'templates': {item_id: self._serialize(template)
+                                      for item_id, template in entries['templates'].items()},
+                        'skipped': sorted(entries['skipped']),
+                    } for library_id, entries in self.libraries.items()
+                },
+            }
+            self.changed = False
+
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        log(sev='debug', msg='Saved metadata cache {}.', args=(self.path,))
+
+    # Cache access
+    def get(self, library_id: str, item_id: str) -> Optional[CLTemplate]:
+        """
+        Get a cached template.
+        :param library_id: The ID of the Content Library
+        :param item_id: The ID of the Content Library item
+        :return: The cached template, or None if the item is not cached
+        """
+        with self.lock:
+            return self.libraries.get(library_id, {}).get('templates', {}).get(item_id)
+
+    def put(self, library_id: str, template: CLTemplate) -> None:
+        """
+        Store a template in the cache.
+        :param library_id: The ID of the Content Library
+        :param template: The template to store
+        :return: None
+        """
+        with self.lock:
+            self._library(library_id)['templates'][template.id] = template
+            self.changed = True
+
+    def is_skipped(self, library_id: str, item_id: str) -> bool:
+        """
+        Check if an item is known to be no vm-template.
+        :param library_id: The ID of the Content Library
+        :param item_id: The ID of the Content Library item
+        :return: True if the item is known to be skipped
+        """
+        with self.lock:
+            return item_id in self.libraries.get(library_id, {}).get('skipped', ())
+
+    def skip(self, library_id: str, item_id: str) -> None:
+        """
+        Remember an item which is no vm-template, so its metadata is not fetched again.
+        :param library_id: The ID of the Content Library
+        :param item_id: The ID of the Content Library item
+        :return: None
+        """
+        with self.lock:
+            self._library(library_id)['skipped'].add(item_id)
+            self.changed = True
+
+    def prune(self, library_id: str, item_ids: list[str]) -> int:
+        """
+        Drop all entries of a library which are no longer part of its listing.
+        :param library_id: The ID of the Content Library
+        :param item_ids: The IDs of all items currently in the Content Library
+        :return: The number of dropped entries
+        """
+        listed = set(item_ids)
+        with self.lock:
+            entries = self._library(library_id)
+            stale = [item_id for item_id in entries['templates'] if item_id not in listed]
+            for item_id in stale:
+                del entries['templates'][item_id]
+            skipped = len(entries['skipped'])
+            entries['skipped'] &= listed
+            dropped = len(stale) + skipped - len(entries['skipped'])
+            if dropped:
+                self.changed = True
+        return dropped
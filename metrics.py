@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import TYPE_CHECKING, Iterator, Optional, Union
+
+from logger import log
+
+if TYPE_CHECKING:
+    from profiler import Profiler
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Prefix of all exported Prometheus metrics
+PREFIX = 'vmw_cls_cleanup'
+
+# Item IDs in API paths, replaced to get one endpoint per kind of request
+ID_PATTERN = re.compile(r'/[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+
+def escape(value: object) -> str:
+    """
+    Helper function to escape a label value for the Prometheus text format.
+    :param value: The label value
+    :return: The value with backslashes, double quotes and line feeds escaped
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Metrics Class
+class Metrics:
+    """Collects phase durations, per-endpoint request latencies and received bytes of a run."""
+
+    def __init__(self):
+        """
+        Class initialization.
+        """
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases: dict[str, float] = {}
+        self.endpoints: dict[str, dict] = {}
+        self.bytes_received = 0
+        self.rate_limit_waits = 0
+        self.rate_limit_wait = 0.0
+        # Optional profiler wrapping each phase; None unless profiling is enabled
+        self.profiler: 'Optional[Profiler]' = None
+
+    @staticmethod
+    def endpoint(method: str, path: str) -> str:
+        """
+        Helper function to turn a request into its endpoint name, e.g. 'GET content/library/item/{id}'.
+        :param method: The HTTP method
+        :param path: The API path, relative to /api/
+        :return: The endpoint name
+        """
+        return '{} {}'.format(method, ID_PATTERN.sub('/{id}', '/' + path)[1:])
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Context manager to measure the duration of a phase. Durations of repeated phases add up.
+        :param name: The name of the phase, e.g. 'login'
+        """
+        with self.profiler.phase(name) if self.profiler is not None else nullcontext():
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def observe(self, endpoint: str, status: Union[int, str], seconds: float, size: int = 0) -> None:
+        """
+        Record a single request.
+        :param endpoint: The endpoint name, see endpoint()
+        :param status: The status code of the response, or 'error' if there was none
+        :param seconds: The latency of the request
+        :param size: The number of bytes received
+        :return: None
+        """
+        with self.lock:
+            if endpoint not in self.endpoints:
+                self.endpoints[endpoint] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(BUCKETS), 'status': {}}
+            data = self.endpoints[endpoint]
+            data['count'] += 1
+            data['sum'] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    data['buckets'][i] += 1
+                    break
+            data['status'][str(status)] = data['status'].get(str(status), 0) + 1
+            self.bytes_received += size
+
+    def received(self, size: int) -> None:
+        """
+        Record bytes received after the request was observed, e.g. of a streamed response body.
+        :param size: The number of bytes received
+        :return: None
+        """
+        with self.lock:
+            self.bytes_received += size
+
+    def observe_wait(self, seconds: float) -> None:
+        """
+        Record the time a request waited on the rate limiter.
+        :param seconds: The time waited
+        :return: None
+        """
+        if seconds <= 0:
+            return
+        with self.lock:
+            self.rate_limit_waits += 1
+            self.rate_limit_wait += seconds
+
+    def summary(self) -> dict:
+        """
+        The collected metrics as JSON-serializable dict.
+        :return: The metrics summary
+        """
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'phases': dict(self.phases),
+                'bytes_received': self.bytes_received,
+                'rate_limit_waits': self.rate_limit_waits,
+                'rate_limit_wait': self.rate_limit_wait,
+                'endpoints': {
+                    endpoint: {
+                        'count': data['count'],
+                        'sum': data['sum'],
+                        'avg': data['sum'] / data['count'] if data['count'] else 0.0,
+                        # Buckets are stored per bucket; the summary holds them cumulative, like Prometheus
+                        'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self._cumulative(data))),
+                        'status': dict(data['status']),
+                    } for endpoint, data in self.endpoints.items()
+                },
+            }
+
+    @staticmethod
+    def _cumulative(data: dict) -> list[int]:
+        """
+        Helper function to get the cumulative bucket counts of an endpoint, including the +Inf bucket.
+        :param data: The collected data of an endpoint
+        :return: The cumulative counts
+        """
+        counts, total = [], 0
+        for count in data['buckets']:
+            total += count
+            counts.append(total)
+        return counts + [data['count']]
+
+    def log_summary(self) -> None:
+        """
+        Log the phase durations and request counts.
+        :return: None
+        """
+        summary = self.summary()
+        log(sev='info', msg='Phase durations: {}.',
+            args=(', '.join('{} {:.3f}s'.format(name, seconds) for name, seconds in summary['phases'].items()),))
+        log(sev='info', msg='API requests: {} in total, {} bytes received.',
+            args=(sum(data['count'] for data in summary['endpoints'].values()), summary['bytes_received']))
+        if summary['rate_limit_waits']:
+            log(sev='info', msg='Rate limiter: {} requests waited {:.3f}s in total.',
+                args=(summary['rate_limit_waits'], summary['rate_limit_wait']))
+        for endpoint, data in summary['endpoints'].items():
+            log(sev='debug', msg=' {}: {} requests, avg. {:.3f}s', args=(endpoint, data['count'], data['avg']))
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        """
+        Helper function to replace a file atomically, so collectors never read a partial file.
+        :param path: The path of the file
+        :param content: The content to write
+        :return: None
+        """
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def write_json(self, path: str, extra: Optional[dict] = None) -> None:
+        """
+        Export the metrics as JSON summary.
+        :param path: The path of the JSON file
+        :param extra: Additional data to include, e.g. the version
+        :return: None
+        """
+        summary = self.summary()
+        summary.update(extra or {})
+        self._write(path=path, content=json.dumps(summary, indent=2))
+
+    def write_prometheus(self, path: str, labels: Optional[dict] = None) -> None:
+        """
+        Export the metrics in the Prometheus text format, e.g. for the textfile collector of the node exporter.
+        :param path: The path of the .prom file
+        :param labels: Additional labels for all metrics, e.g. the Content Library
+        :return: None
+        """
+        summary = self.summary()
+
+        def fmt(extra: dict) -> str:
+            merged = dict(labels or {}, **extra)
+            return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in merged.items()) + '}'
+
+        lines = [
+            '# HELP {}_last_run_timestamp_seconds Start time of the last run.'.format(PREFIX),
+            '# TYPE {}_last_run_timestamp_seconds gauge'.format(PREFIX),
+            '{}_last_run_timestamp_seconds{} {}'.format(PREFIX, fmt({}), summary['started']),
+            '# HELP {}_phase_duration_seconds Duration of the phases of the last run, summed thread time of all '
+            'targets processed in parallel.'.format(PREFIX),
+            '# TYPE {}_phase_duration_seconds gauge'.format(PREFIX),
+        ]
+        for name, seconds in summary['phases'].items():
+            lines.append('{}_phase_duration_seconds{} {}'.format(PREFIX, fmt({'phase': name}), seconds))
+
+        lines += [
+            '# HELP {}_received_bytes Bytes received from the vCenter API in the last run.'.format(PREFIX),
+            '# TYPE {}_received_bytes gauge'.format(PREFIX),
+            '{}_received_bytes{} {}'.format(PREFIX, fmt({}), summary['bytes_received']),
+            '# HELP {}_rate_limit_wait_seconds Time requests waited on the shared rate limiter in the last run.'
+            .format(PREFIX),
+            '# TYPE {}_rate_limit_wait_seconds gauge'.format(PREFIX),
+            '{}_rate_limit_wait_seconds{} {}'.format(PREFIX, fmt({}), summary['rate_limit_wait']),
+            '# HELP {}_requests Requests sent to the vCenter API in the last run.'.format(PREFIX),
+            '# TYPE {}_requests gauge'.format(PREFIX),
+        ]
+        for endpoint, data in summary['endpoints'].items():
+            for status, count in data['status'].items():
+                lines.append('{}_requests{} {}'.format(PREFIX, fmt({'endpoint': endpoint, 'status': status}), count))
+
+        lines += [
+            '# HELP {}_request_duration_seconds Latency of the vCenter API requests in the last run.'.format(PREFIX),
+            '# TYPE {}_request_duration_seconds histogram'.format(PREFIX),
+        ]
+        for endpoint, data in summary['endpoints'].items():
+            for bound, count in data['buckets'].items():
+                lines.append('{}_request_duration_seconds_bucket{} {}'
+                             .format(PREFIX, fmt({'endpoint': endpoint, 'le': bound}), count))
+            lines.append('{}_request_duration_seconds_sum{} {}'
+                         .format(PREFIX, fmt({'endpoint': endpoint}), data['sum']))
+            lines.append('{}_request_duration_seconds_count{} {}'
+                         .format(PREFIX, fmt({'endpoint': endpoint}), data['count']))
+
+        self._write(path=path, content='\n'.join(lines) + '\n')
+
+
+# Metrics of the current run
+metrics = Metrics()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import json
+import os
+import time
+from typing import Optional
+
+from api_vcenter import CLTemplate
+from logger import log
+
+# Version of the plan file format. Plans of another version are rejected.
+PLAN_VERSION = 1
+# Fields stored per planned item, in this order
+PLAN_FIELDS = ['id', 'name', 'creation_ts', 'size']
+
+
+def build_target(endpoint: str, library: str, library_id: str, keep: int,
+                 templates: dict[str, list[CLTemplate]]) -> dict:
+    """
+    Build the plan of a single Content Library from the output of cldata.templates_to_delete.
+    :param endpoint: The vCenter endpoint
+    :param library: The name of the Content Library
+    :param library_id: The ID of the Content Library
+    :param keep: The number of templates kept per name
+    :param templates: The templates to delete, grouped by name
+    :return: The plan of the Content Library as dict
+    """
+    return {
+        'endpoint': endpoint,
+        'library': library,
+        'library_id': library_id,
+        'keep': keep,
+        'groups': {name: [[getattr(template, field) for field in PLAN_FIELDS] for template in templates[name]]
+                   for name in templates if templates[name]},
+    }
+
+
+def target_templates(target: dict) -> dict[str, list[CLTemplate]]:
+    """
+    Turn the planned items of a Content Library back into templates, grouped by name.
+    :param target: The plan of the Content Library
+    :return: The templates to delete, grouped by name
+    """
+    return {name: [CLTemplate(library_id=target['library_id'], **dict(zip(PLAN_FIELDS, item))) for item in items]
+            for name, items in target['groups'].items()}
+
+
+def write_plan(path: str, targets: list[dict], version: str) -> None:
+    """
+    Write a deletion plan file. The file is replaced atomically.
+    :param path: The path of the plan file
+    :param targets: The plans of the Content Libraries, see build_target()
+    :param version: The version of this tool
+    :return: None
+    """
+    data = {
+        'version': PLAN_VERSION,
+        'created': int(time.time()),
+        'tool_version': version,
+        'fields': PLAN_FIELDS,
+        'targets': targets,
+    }
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    log(sev='info', msg='Wrote deletion plan with {} items to {}.',
+        args=(sum(len(items) for target in targets for items in target['groups'].values()), path))
+
+
+def read_plan(path: str) -> Optional[list[dict]]:
+    """
+    Read a deletion plan file.
+    :param path: The path of the plan file
+    :return: The plans of the Content Libraries, or None if the plan file is unreadable or of another version
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        log(sev='warn', msg='Could not read deletion plan {}: {}.', args=(path, e))
+        return None
+
+    if data.get('version') != PLAN_VERSION or data.get('fields') != PLAN_FIELDS:
+        log(sev='warn', msg='Deletion plan {} has an unsupported version {}.', args=(path, data.get('version')))
+        return None
+
+    log(sev='info', msg='Read deletion plan {}, created {} by version {}.',
+        args=(path, time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(data.get('created', 0))),
+              data.get('tool_version')))
+    return data['targets']
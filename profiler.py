@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator
+
+from logger import log
+
+
+# Profiler Class
+class Profiler:
+    """
+    Opt-in CPU and memory profiling per phase: each phase runs under cProfile, including the worker threads started
+    during the phase, and tracemalloc snapshots before and after the phase show where memory was allocated.
+    Repeated phases add up. Phases run in several threads at once, e.g. one per target: a thread started during a
+    phase is profiled as part of the innermost phase of the thread which started it. tracemalloc traces the whole
+    process though, so the allocations of a phase include those of phases running concurrently in other threads.
+    Only used when enabled, see Metrics.phase().
+    """
+
+    def __init__(self, directory: str, frames: int = 1, top: int = 10):
+        """
+        Class initialization. Starts tracing memory allocations right away.
+        :param directory: The directory to write the pstats files and allocation snapshots to
+        :param frames: The number of frames stored per traced allocation; each one adds to the overhead
+        :param top: The number of entries in the allocation snapshots and hot-spot summary
+        """
+        self.directory = directory
+        self.top = top
+        self.lock = threading.Lock()
+        self.stats: dict[str, pstats.Stats] = {}
+        self.allocations: dict[str, list[tracemalloc.StatisticDiff]] = {}
+        # Per thread running a phase: profilers of the threads started during its active phases, innermost last
+        self.active: dict[int, list[list[cProfile.Profile]]] = {}
+        self.thread_start = threading.Thread.start
+        os.makedirs(directory, exist_ok=True)
+        tracemalloc.start(frames)
+
+    def _start_thread(self, thread: threading.Thread) -> None:
+        """
+        Replaces Thread.start() while a phase is active: records the thread running the phase the new thread belongs
+        to, its starting thread or, for threads started by a worker thread, the owner of that worker thread.
+        :param thread: The thread to start
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            owner = ident if ident in self.active else getattr(threading.current_thread(), 'profile_owner', ident)
+        thread.profile_owner = owner
+        self.thread_start(thread)
+
+    def _thread_hook(self, *_) -> None:
+        """
+        Profile function of threads started during a phase: replaces itself with a cProfile profiler of the thread,
+        attributed to the innermost active phase of the thread owning it.
+        """
+        profile = cProfile.Profile()
+        with self.lock:
+            phases = self.active.get(getattr(threading.current_thread(), 'profile_owner', None))
+            if phases:
+                phases[-1].append(profile)
+        if not phases:
+            # Not started during a phase; remove the hook, so it is not called again, e.g. with the lock held
+            sys.setprofile(None)
+            return
+        profile.enable()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Context manager to profile a phase.
+        :param name: The name of the phase, e.g. 'metadata_fetch'
+        """
+        threads = []
+        owner = threading.get_ident()
+        with self.lock:
+            if not self.active:
+                threading.setprofile(self._thread_hook)
+                threading.Thread.start = lambda thread: self._start_thread(thread)
+            self.active.setdefault(owner, []).append(threads)
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            with self.lock:
+                # By identity: the lists of other phases may be equal, e.g. all empty
+                phases = [phase for phase in self.active[owner] if phase is not threads]
+                if phases:
+                    self.active[owner] = phases
+                else:
+                    del self.active[owner]
+                if not self.active:
+                    threading.setprofile(None)
+                    threading.Thread.start = self.thread_start
+
+            stats = pstats.Stats(profile)
+            for thread_profile in threads:
+                thread_profile.create_stats()
+                stats.add(thread_profile)
+            # Leave out the allocations of tracemalloc itself, made while taking the snapshots; filtering the
+            # differences is much cheaper than filtering all traces of both snapshots
+            allocations = [diff for diff in after.compare_to(before, 'lineno')
+                           if diff.traceback[0].filename != tracemalloc.__file__]
+            with self.lock:
+                if name in self.stats:
+                    self.stats[name].add(stats)
+                else:
+                    self.stats[name] = stats
+                self.allocations.setdefault(name, []).extend(allocations[:self.top])
+
+    def write(self) -> None:
+        """
+        Write a pstats file and the top allocations per phase, and log a short hot-spot summary.
+        :return: None
+        """
+        tracemalloc.stop()
+        log(sev='info', msg='Profiles written to {}. Hot spots per phase:', args=(self.directory,))
+        for name, stats in self.stats.items():
+            stats.dump_stats(os.path.join(self.directory, '{}.pstats'.format(name)))
+            allocations = sorted(self.allocations[name], key=lambda diff: diff.size_diff, reverse=True)[:self.top]
+            with open(os.path.join(self.directory, '{}.alloc.txt'.format(name)), 'w') as f:
+                f.write(''.join('{}\n'.format(diff) for diff in allocations))
+
+            # stats.stats: (file, line, function) -> (calls, primitive calls, own time, cumulative time, callers)
+            hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:3]
+            log(sev='info', msg=' {}: {}', args=(name, ', '.join(
+                '{} ({}:{}) {:.3f}s'.format(func, os.path.basename(file), line, data[2])
+                for (file, line, func), data in hot)))
+            if allocations:
+                log(sev='info', msg='  top allocation: {}', args=(allocations[0],))
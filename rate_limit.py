@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import fcntl
+import json
+import os
+import threading
+import time
+
+from logger import log
+
+# Requests which may wait for the rate limit at once, in all processes together; a stored arrival time further ahead
+# comes from a clock stepped backward or a corrupt lock file
+MAX_QUEUED = 256
+
+
+# Shared Rate Limiter Class
+class SharedRateLimiter:
+    """
+    Token bucket rate limiter shared by all processes on a host, implemented as generic cell rate algorithm (GCRA).
+    The state per vCenter endpoint is a single timestamp, stored in a lock file: every request reserves the next free
+    slot while holding an exclusive lock on the file, and waits for its slot after releasing the lock.
+    """
+
+    def __init__(self, path: str, rate: float, burst: int = 1):
+        """
+        Class initialization. Opens the lock file right away.
+        :param path: The path of the lock file, shared by all processes drawing from the limiter
+        :param rate: The maximum number of requests per second, per vCenter endpoint
+        :param burst: The number of requests allowed at once after an idle period
+        """
+        self.path = path
+        self.interval = 1.0 / rate
+        self.tolerance = (max(1, burst) - 1) * self.interval
+        # flock() does not exclude threads sharing the file, so threads of this process take a regular lock first
+        self.lock = threading.Lock()
+        try:
+            # The default path is in /tmp: do not follow a link planted there, and do not let other users write it
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o660)
+        except OSError as e:
+            log(sev='error', msg='Could not open the rate limit file {}: {}', args=(path, e))
+        self.waited = 0.0
+        self.waits = 0
+
+    def acquire(self, key: str) -> float:
+        """
+        Wait until the next request may be sent.
+        :param key: The rate limited resource, e.g. the vCenter endpoint
+        :return: The time waited, in seconds
+        """
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                try:
+                    state = json.loads(os.pread(self.fd, 65536, 0) or b'{}')
+                except ValueError:
+                    state = {}
+                # Keep only valid timestamps, anything else in the file is corrupt
+                now = time.time()
+                state = {k: v for k, v in state.items() if isinstance(v, (int, float))} \
+                    if isinstance(state, dict) else {}
+                # Theoretical arrival time of the next request; a request may be sent up to the tolerance earlier
+                arrival = max(state.get(key, 0.0), now)
+                if arrival > now + self.tolerance + self.interval * MAX_QUEUED:
+                    log(sev='warn', msg='Rate limit state of {} is {:.0f}s ahead, resetting it.',
+                        args=(key, arrival - now))
+                    arrival = now
+                wait = max(0.0, arrival - self.tolerance - now)
+                state[key] = arrival + self.interval
+                # Drop the state of endpoints not used for a while, it no longer limits anything
+                state = {k: v for k, v in state.items() if v > now - 60}
+                data = json.dumps(state).encode()
+                os.pwrite(self.fd, data, 0)
+                os.ftruncate(self.fd, len(data))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            if wait > 0:
+                self.waited += wait
+                self.waits += 1
+
+        if wait > 0:
+            log(sev='debug', msg='- Rate limit reached, waiting {:.3f}s...', args=(wait,))
+            time.sleep(wait)
+        return wait
+
+    def close(self) -> None:
+        """
+        Close the lock file.
+        :return: None
+        """
+        os.close(self.fd)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+# Status codes worth retrying, and the subset of them signaling an overloaded vCenter
+RETRY_STATUS = {429, 502, 503, 504}
+OVERLOAD_STATUS = {429, 503, 504}
+# Status codes of a gateway in front of the vCenter; the request may have been executed nevertheless
+GATEWAY_STATUS = {502, 504}
+
+
+# Retry Policy
+@dataclass
+class RetryPolicy:
+    """
+    Dataclass to hold the retry settings: exponential backoff with full jitter, honoring Retry-After.
+    """
+    retries: int = 3  # retries after the first attempt
+    backoff: float = 0.5  # base delay in seconds
+    max_backoff: float = 30.0  # upper bound of a single delay in seconds
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        Helper function to parse a Retry-After header, given either in seconds or as HTTP date.
+        :param value: The value of the Retry-After header
+        :return: The delay in seconds, or None if the header is missing or invalid
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        # Rarely needed, and email takes a while to import
+        from email.utils import parsedate_to_datetime
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        The delay before the next attempt.
+        :param attempt: The number of the failed attempt, starting with 0
+        :param retry_after: The Retry-After header of the failed response
+        :return: The delay in seconds
+        """
+        requested = self.parse_retry_after(retry_after)
+        if requested is not None:
+            return min(requested, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+# Adaptive Concurrency Class
+class AdaptiveConcurrency:
+    """
+    AIMD controller for the number of requests in flight: the limit grows by one per limit-many healthy responses
+    and is halved when vCenter signals overload, at most once per cooldown period.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, cooldown: float = 1.0):
+        """
+        Class initialization. Starts with the maximum limit.
+        :param max_limit: The maximum number of requests in flight
+        :param min_limit: The minimum number of requests in flight
+        :param cooldown: The minimum time between two decreases, in seconds
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.lowest = self.max_limit
+        self.in_flight = 0
+        self.decreased = 0.0
+        self.condition = threading.Condition()
+
+    @property
+    def effective(self) -> int:
+        """
+        The current number of requests allowed in flight.
+        """
+        return max(self.min_limit, int(self.limit))
+
+    def acquire(self) -> None:
+        """
+        Wait for a free slot and occupy it.
+        :return: None
+        """
+        with self.condition:
+            while self.in_flight >= self.effective:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        """
+        Free an occupied slot.
+        :return: None
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def on_success(self) -> None:
+        """
+        Additive increase after a healthy response.
+        :return: None
+        """
+        with self.condition:
+            if self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+    def on_overload(self) -> None:
+        """
+        Multiplicative decrease after vCenter signaled overload.
+        :return: None
+        """
+        with self.condition:
+            now = time.monotonic()
+            if now - self.decreased < self.cooldown:
+                return
+            self.decreased = now
+            self.limit = max(float(self.min_limit), self.limit / 2)
+            self.lowest = min(self.lowest, self.effective)
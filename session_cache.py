@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from logger import log
+
+# Version of the session cache file format. Caches of another version are discarded.
+CACHE_VERSION = 1
+
+
+# Session Cache Class
+class SessionCache:
+    """
+    Local cache of vCenter API session tokens, so back-to-back runs can skip the login. The file is only readable by
+    its owner. Entries are keyed by a hash of endpoint and username, and are evicted when they were not used for longer
+    than the TTL, or when vCenter no longer accepts them.
+    """
+
+    def __init__(self, path: str, ttl: int = 1500):
+        """
+        Class initialization. The cache is empty until load() is called.
+        :param path: The path of the JSON cache file
+        :param ttl: The time in seconds after its last use until a token is evicted. Should stay below the idle
+                    timeout of vCenter sessions (30 minutes by default).
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    @staticmethod
+    def _key(endpoint: str, username: str) -> str:
+        """
+        Helper function to get the cache key of an endpoint and username.
+        :param endpoint: The vCenter endpoint
+        :param username: The username of the session
+        :return: The cache key
+        """
+        return hashlib.sha256('{}\0{}'.format(endpoint, username).encode()).hexdigest()
+
+    def _evict(self) -> None:
+        """
+        Drop all tokens not used within the TTL. Must be called with the lock held.
+        :return: None
+        """
+        now = time.time()
+        for key in [key for key, entry in self.sessions.items() if now - entry['used'] > self.ttl]:
+            del self.sessions[key]
+
+    # Persistence
+    def load(self) -> None:
+        """
+        Load the cache from disk. A missing, unreadable or outdated cache file results in an empty cache.
+        :return: None
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log(sev='warn', msg='Could not read session cache {}: {}. Starting with an empty cache.',
+                args=(self.path, e))
+            return
+
+        if data.get('version') != CACHE_VERSION:
+            log(sev='warn', msg='Session cache {} has an unsupported version, starting with an empty cache.',
+                args=(self.path,))
+            return
+
+        with self.lock:
+            self.sessions = data.get('sessions', {})
+            self._evict()
+
+    def save(self) -> None:
+        """
+        Write the cache to disk, readable by the owner only. The file is replaced atomically.
+        :return: None
+        """
+        with self.lock:
+            self._evict()
+            data = {'version': CACHE_VERSION, 'sessions': dict(self.sessions)}
+
+        tmp_path = '{}.tmp'.format(self.path)
+        # Create the file with restricted permissions right away, the tokens must never be readable by others
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        log(sev='debug', msg='Saved session cache {}.', args=(self.path,))
+
+    # Cache access
+    def get(self, endpoint: str, username: str) -> Optional[str]:
+        """
+        Get a cached session token.
+        :param endpoint: The vCenter endpoint
+        :param username: The username of the session
+        :return: The session token, or None if there is no token within the TTL
+        """
+        with self.lock:
+            self._evict()
+            entry = self.sessions.get(self._key(endpoint, username))
+            return entry['token'] if entry else None
+
+    def put(self, endpoint: str, username: str, token: str) -> None:
+        """
+        Store a session token, or refresh its last use.
+        :param endpoint: The vCenter endpoint
+        :param username: The username of the session
+        :param token: The session token
+        :return: None
+        """
+        with self.lock:
+            self.sessions[self._key(endpoint, username)] = {'token': token, 'used': time.time()}
+
+    def evict(self, endpoint: str, username: str) -> None:
+        """
+        Drop a session token, e.g. after vCenter rejected it.
+        :param endpoint: The vCenter endpoint
+        :param username: The username of the session
+        :return: None
+        """
+        with self.lock:
+            self.sessions.pop(self._key(endpoint, username), None)
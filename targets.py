@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+import json
+from dataclasses import dataclass, field
+from os import environ
+from typing import Optional
+
+from deletion import DeletionResult, format_size, parse_size
+from logger import log
+
+
+# Target object
+@dataclass
+class Target:
+    """
+    Dataclass to hold a single Content Library to clean up.
+    """
+    endpoint: str  # 'vcenter.example.com'
+    library: str  # 'packer-templates'
+    keep: int = 1  # with a storage budget, the minimum number to keep
+    budget: Optional[int] = None  # storage budget in bytes
+    username: Optional[str] = None
+    password: Optional[str] = None
+    insecure: bool = True
+
+    @property
+    def label(self) -> str:
+        """
+        The name of the target in logs and reports, e.g. 'vcenter.example.com/packer-templates'.
+        """
+        return '{}/{}'.format(self.endpoint, self.library)
+
+
+# Target result object
+@dataclass
+class TargetResult:
+    """
+    Dataclass to hold the outcome of the cleanup of a single Content Library.
+    """
+    endpoint: str
+    library: str
+    success: bool = False
+    error: Optional[str] = None
+    templates: int = 0  # vm-templates found
+    planned: int = 0  # templates selected for deletion
+    results: list[DeletionResult] = field(default_factory=list)
+    plan: Optional[dict] = None  # deletion plan of the library in plan mode
+
+
+def load_targets(config: str, default: Target) -> list[Target]:
+    """
+    Load the targets from a JSON list of objects, given inline or as path to a JSON file. Each object needs an
+    'endpoint' and a 'library'; 'keep', 'budget' (the storage budget, e.g. '500GiB'), 'username', 'password_env' (the
+    name of the environment variable holding the password) and 'insecure' fall back to the values of the default
+    target.
+    :param config: The JSON list or the path of the JSON file; if empty, only the default target is returned
+    :param default: The target configured by the PKR_VAR_* environment variables
+    :return: The list of targets
+    """
+    if not config:
+        return [default]
+
+    try:
+        if config.lstrip().startswith('['):
+            entries = json.loads(config)
+        else:
+            with open(config, 'r') as f:
+                entries = json.load(f)
+    except (OSError, ValueError) as e:
+        log(sev='error', msg='Could not read the targets config: {}', args=(e,))
+        return []
+
+    targets = []
+    for entry in entries:
+        if not entry.get('endpoint') or not entry.get('library'):
+            log(sev='error', msg='Target {} needs an endpoint and a library.', args=(entry,))
+            return []
+        password = default.password
+        if entry.get('password_env'):
+            password = environ.get(entry['password_env'])
+        budget = parse_size(str(entry['budget'])) if entry.get('budget') else default.budget
+        targets.append(Target(endpoint=entry['endpoint'], library=entry['library'],
+                              keep=max(1, int(entry.get('keep', default.keep))), budget=budget,
+                              username=entry.get('username', default.username), password=password,
+                              insecure=bool(entry.get('insecure', default.insecure))))
+    return targets
+
+
+def print_report(results: list[TargetResult], dry_run: bool = False) -> None:
+    """
+    Helper function to print a consolidated report of all targets.
+    :param results: The results of the targets
+    :param dry_run: The flag to mark the freed bytes as projected
+    """
+    names = ['{}/{}'.format(result.endpoint, result.library) for result in results]
+    width = max([len(name) for name in names] + [len('Target')])
+    row = ' {:<' + str(width) + 's} | {:>6} | {:>9} | {:>7} | {:>7} | {:>6} | {:>12}'
+    log(sev='info', msg='Target report{}:', args=(' (dry-run, projected)' if dry_run else '',))
+    log(sev='info', msg=row.format('Target', 'Status', 'Templates', 'Planned', 'Deleted', 'Failed', 'Freed'))
+    for name, result in zip(names, results):
+        deleted = [r for r in result.results if r.success]
+        log(sev='info', msg=row.format(name, 'ok' if result.success else 'FAILED', result.templates, result.planned,
+                                       len(deleted), sum(not r.success and not r.skipped for r in result.results),
+                                       format_size(sum(r.template.size or 0 for r in deleted))))
+    for name, result in zip(names, results):
+        if result.error:
+            log(sev='warn', msg='Target {} failed: {}', args=(name, result.error))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+
+from api_vcenter import CLTemplate
+from journal import Journal
+
+# Settings
+LIBRARY_ID = '02c04568-0e25-45a1-b23a-39d912b86e58'
+
+
+def template(item_id: str) -> CLTemplate:
+    """
+    Helper function to create a template for the journal.
+    :param item_id: The ID of the template
+    :return: The CLTemplate object
+    """
+    return CLTemplate(item_id, 'Ubuntu 24.04-Template (1)', 'vm-template', LIBRARY_ID, '1', 1024, 1, None)
+
+
+class JournalTest(unittest.TestCase):
+    """Checkpoint journal of interrupted runs."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'journal.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def resume(self) -> Journal:
+        journal = Journal(path=self.path)
+        journal.load()
+        return journal
+
+    def test_resume_twice_after_incomplete_record(self):
+        # The first run is killed while writing a record
+        journal = self.resume()
+        journal.put(library_id=LIBRARY_ID, template=template('a'))
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"type":"template","libr')
+
+        # The records of the resumed run survive the next resume
+        journal = self.resume()
+        self.assertIsNotNone(journal.get(library_id=LIBRARY_ID, item_id='a'))
+        journal.deleted(library_id=LIBRARY_ID, item_id='b')
+        journal.put(library_id=LIBRARY_ID, template=template('c'))
+        journal.close()
+
+        journal = self.resume()
+        self.assertIsNotNone(journal.get(library_id=LIBRARY_ID, item_id='a'))
+        self.assertIsNotNone(journal.get(library_id=LIBRARY_ID, item_id='c'))
+        self.assertEqual(journal.deletions, {'b'})
+        journal.close()
+
+    def test_record_without_type(self):
+        journal = self.resume()
+        journal.put(library_id=LIBRARY_ID, template=template('a'))
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"library":"x"}\n')
+
+        journal = self.resume()
+        self.assertIsNotNone(journal.get(library_id=LIBRARY_ID, item_id='a'))
+        journal.put(library_id=LIBRARY_ID, template=template('c'))
+        journal.close()
+        journal = self.resume()
+        self.assertIsNotNone(journal.get(library_id=LIBRARY_ID, item_id='c'))
+        journal.close()
+
+
+if '__main__' == __name__:
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import json
+import random
+import unittest
+
+from json_stream import iter_array
+
+# Settings
+DOCUMENTS = 500
+STRINGS = ['', 'plain', 'Ubuntu_24.04-Template (202405260033)', 'é', 'Größe', '模板', '🙂 emoji', 'quote " and \\ slash',
+           'line\nbreak', ' ']
+NUMBERS = [0, -1, 7, 1234567890123, 0.5, -2.25e-10, 6.02e23]
+LITERALS = [True, False, None]
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    """
+    Helper function to create a random JSON value.
+    :param rng: The random generator
+    :param depth: The nesting depth of the value
+    :return: The value
+    """
+    kind = rng.randrange(5 if depth < 3 else 3)
+    if kind == 0:
+        return rng.choice(STRINGS)
+    if kind == 1:
+        return rng.choice(NUMBERS)
+    if kind == 2:
+        return rng.choice(LITERALS)
+    if kind == 3:
+        return [random_value(rng=rng, depth=depth + 1) for _ in range(rng.randint(0, 4))]
+    return {rng.choice(STRINGS): random_value(rng=rng, depth=depth + 1) for _ in range(rng.randint(0, 4))}
+
+
+def split(data: bytes, rng: random.Random) -> list[bytes]:
+    """
+    Helper function to split a document into chunks of random size, from single bytes up to the whole document.
+    :param data: The document
+    :param rng: The random generator
+    :return: The chunks
+    """
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        size = rng.choice([1, 2, 3, rng.randint(1, 16), rng.randint(1, len(data))])
+        chunks.append(data[pos:pos + size])
+        pos += size
+    return chunks
+
+
+class IterArrayTest(unittest.TestCase):
+    """Incremental decoding of JSON arrays, compared with json.loads."""
+
+    def test_random_chunks(self):
+        rng = random.Random(3)
+        for _ in range(DOCUMENTS):
+            values = [random_value(rng=rng) for _ in range(rng.randint(0, 8))]
+            separators = rng.choice([(',', ':'), (', ', ': '), (' ,\n ', ' :\t')])
+            text = json.dumps(values, ensure_ascii=rng.random() < 0.2, separators=separators)
+            if rng.random() < 0.5:
+                text = ' \n{}\r\n'.format(text)
+            data = text.encode('utf-8')
+            with self.subTest(text=text):
+                self.assertEqual(list(iter_array(split(data=data, rng=rng))), json.loads(text))
+
+    def test_values_cut_at_chunk_boundary(self):
+        # Numbers and literals are not closed by a delimiter; each must be complete before it is decoded
+        for text in ('[12345,-6.5e-3,true,false,null]', '[1]', '[ 100 ]', '["é",2]', '[{"a":1},[2,3]]'):
+            data = text.encode('utf-8')
+            for pos in range(1, len(data)):
+                with self.subTest(text=text, pos=pos):
+                    self.assertEqual(list(iter_array([data[:pos], data[pos:]])), json.loads(text))
+
+    def test_invalid(self):
+        for text in ('', '{"a": 1}', '[1, 2', '[1 2]', '[1,]', '[1] x', '[tru]'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(iter_array([text.encode('utf-8')]))
+
+
+if '__main__' == __name__:
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from benchmark.mock_vcenter import MockVCenter, LIBRARY_NAME
+
+# Settings
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+
+def run_main(url: str, mode: str, plan_file: str) -> subprocess.CompletedProcess:
+    """
+    Run main.py against the given endpoint in a child process.
+    :param url: The base URL of the mock vCenter
+    :param mode: The mode of the run, e.g. 'plan'
+    :param plan_file: The path of the deletion plan
+    :return: The completed process
+    """
+    env = dict(os.environ)
+    env.update({
+        'PKR_VAR_vsphere_endpoint': url,
+        'PKR_VAR_vsphere_username': 'test@vsphere.local',
+        'PKR_VAR_vsphere_password': 'test',
+        'PKR_VAR_vsphere_content_library': LIBRARY_NAME,
+        'CLEANUP_SCRIPT_MODE': mode,
+        'CLEANUP_SCRIPT_PLAN_FILE': plan_file,
+    })
+    return subprocess.run([sys.executable, MAIN], cwd=ROOT, env=env, capture_output=True, text=True)
+
+
+class PlanTest(unittest.TestCase):
+    """Plan and apply against the mock vCenter."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.plan_file = os.path.join(self.directory.name, 'plan.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_empty_library(self):
+        # A library without vm-templates is planned with nothing to delete, and applying the plan deletes nothing
+        mock = MockVCenter(items=20, template_ratio=0.0).start()
+        try:
+            run = run_main(url=mock.url, mode='plan', plan_file=self.plan_file)
+            self.assertEqual(run.returncode, 0, run.stdout + run.stderr)
+            with open(self.plan_file) as f:
+                targets = json.load(f)['targets']
+            self.assertEqual(len(targets), 1)
+            self.assertEqual(targets[0]['library'], LIBRARY_NAME)
+            self.assertEqual(targets[0]['groups'], {})
+
+            run = run_main(url=mock.url, mode='apply', plan_file=self.plan_file)
+            self.assertEqual(run.returncode, 0, run.stdout + run.stderr)
+            self.assertNotIn('DELETE content/library/item/{id}', mock.counts)
+        finally:
+            mock.stop()
+
+
+if '__main__' == __name__:
+    unittest.main()
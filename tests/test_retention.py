@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import cldata
+from api_vcenter import CLTemplate
+
+# Settings
+LIBRARIES = 300
+LIBRARY_ID = '02c04568-0e25-45a1-b23a-39d912b86e58'
+
+
+def random_library(rng: random.Random) -> list[CLTemplate]:
+    """
+    Helper function to create a random library: a few names with few templates each, templates not following the
+    naming scheme, creation times close together so they tie, and templates without a size.
+    :param rng: The random generator
+    :return: The templates of the library
+    """
+    names = ['Ubuntu_{:02d}.04-Template'.format(i) for i in range(rng.randint(1, 5))]
+    templates = []
+    for i in range(rng.randint(0, 30)):
+        name = '{} ({})'.format(rng.choice(names), i) if rng.random() < 0.9 else 'manual-vm-{}'.format(i)
+        size = rng.choice([None, rng.randint(1, 100) * 2 ** 30])
+        templates.append(CLTemplate('{:08x}-item'.format(rng.getrandbits(32)), name, 'vm-template', LIBRARY_ID, '1',
+                                    size, rng.randint(0, 10), None))
+    return templates
+
+
+def group(templates: list[CLTemplate]) -> dict[str, list[CLTemplate]]:
+    """
+    Helper function to group the templates following the naming scheme by name, newest first.
+    :param templates: The templates to group
+    :return: The templates grouped by extracted name
+    """
+    groups = {}
+    for template in templates:
+        name = cldata.extract_by_name(template=template)
+        if name is not None:
+            groups.setdefault(name, []).append(template)
+    for name in groups:
+        groups[name].sort(key=lambda x: (x.creation_ts, x.id), reverse=True)
+    return groups
+
+
+def sort_and_slice(templates: list[CLTemplate], keep: int) -> dict[str, list[CLTemplate]]:
+    """
+    Reference retention: sort each name newest first and delete all but the first ones to keep.
+    :param templates: The templates of the library
+    :param keep: The number of templates to keep per name
+    :return: The templates to delete grouped by extracted name, newest first
+    """
+    return {name: group_templates[keep:] for name, group_templates in group(templates).items()}
+
+
+def greedy_budget(templates: list[CLTemplate], budget: int, keep: int, scope: str) -> dict[str, list[CLTemplate]]:
+    """
+    Reference budget selection: delete the oldest eligible templates one by one until the budget is met.
+    :param templates: The templates of the library
+    :param budget: The storage budget in bytes
+    :param keep: The minimum number of templates to keep per name
+    :param scope: The scope of the budget, 'library' or 'group'
+    :return: The templates to delete grouped by extracted name, newest first
+    """
+    groups = group(templates)
+    if scope == 'group':
+        pools = [(group_templates, group_templates[keep:]) for group_templates in groups.values()]
+    else:
+        pools = [(templates, [template for group_templates in groups.values() for template in group_templates[keep:]])]
+
+    selected = {}
+    for pool, eligible in pools:
+        used = sum(template.size or 0 for template in pool)
+        for template in sorted(eligible, key=lambda x: (x.creation_ts, x.id)):
+            if used <= budget:
+                break
+            selected.setdefault(cldata.extract_by_name(template=template), []).insert(0, template)
+            used -= template.size or 0
+    return selected
+
+
+class RetentionTest(unittest.TestCase):
+    """Retention and budget selection compared with straightforward reference implementations."""
+
+    def test_templates_to_delete(self):
+        rng = random.Random(7)
+        for _ in range(LIBRARIES):
+            templates = random_library(rng=rng)
+            keep = rng.randint(1, 8)
+            with self.subTest(templates=len(templates), keep=keep):
+                self.assertEqual(cldata.templates_to_delete(templates=iter(templates), keep=keep),
+                                 sort_and_slice(templates=templates, keep=keep))
+                self.assertEqual(cldata.templates_to_delete(templates={t.id: t for t in templates}, keep=keep),
+                                 sort_and_slice(templates=templates, keep=keep))
+
+    def test_templates_over_budget(self):
+        rng = random.Random(11)
+        for _ in range(LIBRARIES):
+            templates = random_library(rng=rng)
+            keep = rng.randint(1, 8)
+            budget = rng.randint(0, 800) * 2 ** 30
+            for scope in ('library', 'group'):
+                with self.subTest(templates=len(templates), keep=keep, budget=budget, scope=scope):
+                    self.assertEqual(cldata.templates_over_budget(templates=iter(templates), budget=budget, keep=keep,
+                                                                  scope=scope),
+                                     greedy_budget(templates=templates, budget=budget, keep=keep, scope=scope))
+
+
+if '__main__' == __name__:
+    unittest.main()
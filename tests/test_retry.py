@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import time
+import unittest
+
+import api_vcenter
+from benchmark.mock_vcenter import MockVCenter
+
+
+# Gateway Timeout Mock Class
+class GatewayTimeoutVCenter(MockVCenter):
+    """Mock vCenter behind a gateway which times out on the first deletion of each item, after it was executed."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.timed_out = set()
+
+    def handle(self, method, path, query, body, headers):
+        status, response = super().handle(method, path, query, body, headers)
+        if method == 'DELETE' and status == 204 and path not in self.timed_out:
+            self.timed_out.add(path)
+            return 504, {'error_type': 'GATEWAY_TIMEOUT'}
+        return status, response
+
+
+# Stalling Mock Class
+class StallingVCenter(MockVCenter):
+    """Mock vCenter which stalls on the first metadata request of each item."""
+
+    def __init__(self, stall: float, **kwargs):
+        super().__init__(**kwargs)
+        self.stall = stall
+        self.stalled = set()
+
+    def handle(self, method, path, query, body, headers):
+        if method == 'GET' and path.startswith('/api/content/library/item/') and path not in self.stalled:
+            self.stalled.add(path)
+            time.sleep(self.stall)
+        return super().handle(method, path, query, body, headers)
+
+
+class RetryTest(unittest.TestCase):
+    """Retries of requests against the mock vCenter."""
+
+    def setUp(self):
+        self.mock = GatewayTimeoutVCenter(items=10, template_ratio=1.0).start()
+        self.api = api_vcenter.create(api_host=self.mock.url, api_user='test@vsphere.local', api_pass='test',
+                                      backoff=0.01)
+        self.assertTrue(self.api.login())
+
+    def tearDown(self):
+        self.api.close()
+        self.mock.stop()
+
+    def test_retried_delete_not_found(self):
+        # The first attempt deleted the item, so the 404 of the retry means the deletion succeeded
+        item_id = next(iter(self.mock.items))
+        self.assertEqual(self.api.delete_library_item(item_id=item_id), (True, None))
+        self.assertNotIn(item_id, self.mock.items)
+        self.assertEqual(self.mock.counts['DELETE content/library/item/{id}'], 2)
+
+    def test_delete_not_found(self):
+        # Without an earlier attempt, a 404 is still an error
+        with self.assertRaises(Exception):
+            self.api.delete_library_item(item_id='00000000-0000-0000-0000-000000000000')
+
+    def test_fetch_failed_skipped(self):
+        # An item whose metadata can not be retrieved is skipped, the other items are still fetched
+        item_ids = ['00000000-0000-0000-0000-000000000000'] + list(self.mock.items)
+        self.assertEqual(set(self.api.fetch_cls_templates(item_ids=item_ids)), set(self.mock.items))
+
+
+class TimeoutTest(unittest.TestCase):
+    """Timeouts of requests against the mock vCenter."""
+
+    def test_stalled_request_retried(self):
+        # The first request stalls longer than the read timeout, the retry is answered right away
+        mock = StallingVCenter(stall=2.0, items=10, template_ratio=1.0).start()
+        api = api_vcenter.create(api_host=mock.url, api_user='test@vsphere.local', api_pass='test', backoff=0.01,
+                                 timeout=(1.0, 0.2))
+        try:
+            self.assertTrue(api.login())
+            item_id = next(iter(mock.items))
+            started = time.monotonic()
+            self.assertEqual(api.get_library_item_metadata(item_id=item_id)['id'], item_id)
+            self.assertLess(time.monotonic() - started, 1.0)
+            self.assertEqual(api.retries, 1)
+        finally:
+            api.close()
+            mock.stop()
+
+
+if '__main__' == __name__:
+    unittest.main()